@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+
+"""
+The build code shared by Scale/setup.py and cyImage/setup.py (which are
+what to run; see them).
+
+build() compiles the given Cython extensions from this directory, so
+that each extension's module is placed in its package wherever the
+setup.py is run from. The extensions are optimized (-O3, or /O2 for
+MSVC) and use OpenMP so that Scale.Fast's scale() can use several cores;
+set OPENMP=0 to build without it if the compiler doesn't support it.
+"""
+
+import os
+import numpy
+import Cython.Build
+try:
+    from setuptools import Extension, setup
+    from setuptools.command.build_ext import build_ext
+except ImportError: # No setuptools: fall back to the standard library's
+    from distutils.core import Extension, setup # distutils (Python 3.11
+    from distutils.command.build_ext import build_ext # or older only)
+
+
+class BuildExt(build_ext):
+
+    def build_extensions(self):
+        # The flags depend on which compiler is actually used
+        msvc = self.compiler.compiler_type == "msvc"
+        openmp = os.environ.get("OPENMP", "1") != "0"
+        for extension in self.extensions:
+            extension.extra_compile_args = ["/O2"] if msvc else ["-O3"]
+            if openmp:
+                extension.extra_compile_args.append("/openmp" if msvc else
+                        "-fopenmp")
+                if not msvc:
+                    extension.extra_link_args = ["-fopenmp"]
+        super().build_extensions()
+
+
+def extension(module, source):
+    """returns an Extension for the named module (e.g., "Scale.Fast")
+    from the given .pyx source (relative to this directory)"""
+    return Extension(module, [source], include_dirs=[numpy.get_include()])
+
+
+def scale_fast():
+    return extension("Scale.Fast", os.path.join("Scale", "Fast.pyx"))
+
+
+def build(name, extensions):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    setup(name=name, cmdclass=dict(build_ext=BuildExt),
+            ext_modules=Cython.Build.cythonize(extensions))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+    import Image
+Use the above rather than importing this module explicitly. This works
+because Image's _Registry maps the .argb suffix to this module, which Image
+imports on demand the first time a .argb file is loaded, saved, or probed.
+
+This Image plugin module can read and write .argb files. These are a
+24-byte header (a signature, then the width, height, x_hot and y_hot as
+little-endian int32s, with -1 for no hotspot) followed by the pixels as
+little-endian uint32 ARGB values. They are meant as a cache of already
+decoded images rather than for interchange.
+
+If numpy is installed a loaded image's pixels are a copy-on-write
+numpy.memmap of the file, so there is no parsing or decoding, the data
+is only read as it is used, and processes that load the same file share
+the same pages of the operating system's cache.
+
+Its meta data may optionally include x_hot and y_hot ints to indicate
+the image's hotspot.
+"""
+
+import io
+import os
+import struct
+import sys
+import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    import array
+
+
+_SIGNATURE = b"\x89ARGB\r\n\x1a"
+_HEADER = struct.Struct("<8s4i")
+
+
+def can_load(filename):
+    """Returns 100 if this module can do a lossless load, 0 if it can't
+    load the file, and something inbetween if it can do a lossy load."""
+    return 100 if os.path.splitext(filename)[1].lower() == ".argb" else 0
+
+
+def can_save(filename):
+    """Returns 100 if this module can do a lossless save, 0 if it can't
+    save the file, and something inbetween if it can do a lossy save."""
+    return can_load(filename)
+
+
+def load(image, filename):
+    """load an ARGB file
+
+    With numpy the pixels are memory-mapped rather than read."""
+    with open(filename, "rb") as file:
+        image.width, image.height, x, y = _read_header(file, filename)
+        if x >= 0 and y >= 0:
+            image.meta["x_hot"] = x
+            image.meta["y_hot"] = y
+        if (numpy is not None and sys.byteorder == "little" and
+                image.width * image.height):
+            image.pixels = numpy.memmap(file, dtype=numpy.uint32,
+                    mode="c", offset=_HEADER.size,
+                    shape=(image.width * image.height,))
+        else:
+            image.pixels = _read_pixels(file, image.width * image.height)
+
+
+def decode(image, data, filename):
+    """load an ARGB image from data, the bytes of an ARGB file (as bytes
+    or any other buffer, e.g., a memoryview); the pixels are a copy"""
+    image.width, image.height, x, y = _read_header(io.BytesIO(
+            data[:_HEADER.size]), filename, len(data))
+    if x >= 0 and y >= 0:
+        image.meta["x_hot"] = x
+        image.meta["y_hot"] = y
+    count = image.width * image.height
+    if numpy is not None:
+        image.pixels = numpy.frombuffer(data, dtype="<u4", count=count,
+                offset=_HEADER.size).astype(numpy.uint32)
+    else:
+        image.pixels = Image.create_array(0, 0)
+        image.pixels.frombytes(data[_HEADER.size:])
+        if sys.byteorder != "little":
+            image.pixels.byteswap()
+
+
+def probe(filename):
+    """returns the ARGB file's (width, height) reading only its header"""
+    with open(filename, "rb") as file:
+        return _read_header(file, filename)[:2]
+
+
+def read_rows(filename):
+    """returns the ARGB file's width, height, and an iterator of its
+    rows of pixels; each row is only read when it is needed"""
+    file = open(filename, "rb")
+    try:
+        width, height, _, _ = _read_header(file, filename)
+    except Exception:
+        file.close()
+        raise
+    return width, height, _rows(file, width, height)
+
+
+def _rows(file, width, height):
+    with file:
+        for _ in range(height):
+            yield _read_pixels(file, width)
+
+
+def save(image, filename):
+    """save an ARGB file"""
+    offsets = (y * image.width for y in range(image.height))
+    _write(filename, image.width, image.height, image.meta.get("x_hot"),
+            image.meta.get("y_hot"), (image.pixels[offset:offset +
+            image.width] for offset in offsets))
+
+
+def encode(image, filename):
+    """returns the bytes of the ARGB file that save() would write"""
+    file = io.BytesIO()
+    offsets = (y * image.width for y in range(image.height))
+    _write_file(file, image.width, image.height, image.meta.get("x_hot"),
+            image.meta.get("y_hot"), (image.pixels[offset:offset +
+            image.width] for offset in offsets))
+    return file.getvalue()
+
+
+def write_rows(filename, width, height, rows):
+    """save an ARGB file whose pixels are given by an iterable of height
+    rows of width ARGB pixels each; each row is written as it arrives"""
+    _write(filename, width, height, None, None, rows)
+
+
+def _read_header(file, filename, size=None):
+    # Returns the width, height, x_hot and y_hot after checking that the
+    # file (of size bytes, if given, else its size on disk) is the right
+    # size for them
+    data = file.read(_HEADER.size)
+    if len(data) != _HEADER.size:
+        raise Image.Error("'{}' is not an ARGB file".format(filename))
+    signature, width, height, x, y = _HEADER.unpack(data)
+    if signature != _SIGNATURE or width < 0 or height < 0:
+        raise Image.Error("'{}' is not an ARGB file".format(filename))
+    if size is None:
+        size = os.fstat(file.fileno()).st_size
+    if size != _HEADER.size + width * height * 4:
+        raise Image.Error("'{}' is truncated or corrupt".format(filename))
+    return width, height, x, y
+
+
+def _read_pixels(file, count):
+    if numpy is not None:
+        return numpy.fromfile(file, dtype="<u4", count=count).astype(
+                numpy.uint32, copy=False)
+    pixels = Image.create_array(0, 0)
+    pixels.fromfile(file, count)
+    if sys.byteorder != "little":
+        pixels.byteswap()
+    return pixels
+
+
+def _write(filename, width, height, x, y, rows):
+    # The file is written to a temporary and then renamed so that saving
+    # over a file that is memory-mapped (e.g., by image.save() after
+    # load()) leaves the existing mapping intact
+    temporary = filename + ".tmp"
+    try:
+        with open(temporary, "wb") as file:
+            _write_file(file, width, height, x, y, rows)
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _write_file(file, width, height, x, y, rows):
+    x = -1 if x is None or y is None else x
+    y = -1 if x == -1 else y
+    file.write(_HEADER.pack(_SIGNATURE, width, height, x, y))
+    for row in rows:
+        file.write(_little_endian_bytes(row))
+
+
+def _little_endian_bytes(pixels):
+    if numpy is not None:
+        return numpy.asarray(pixels, dtype="<u4").tobytes()
+    if sys.byteorder != "little":
+        pixels = array.array(pixels.typecode, pixels)
+        pixels.byteswap()
+    return pixels.tobytes()
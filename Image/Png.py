@@ -12,16 +12,27 @@
 """
     import Image
 Use the above rather than importing this module explicitly. This works
-because Image imports any modules it finds (to allow for new image
-processing modules to be added post-facto).
+because Image's _Registry maps the .png suffix to this module, which Image
+imports on demand the first time a .png file is loaded, saved, or probed.
 
-This Image plugin module can read and write .png files if PyPNG is
-installed. See http://pypi.python.org/pypi/pypng
+This Image plugin module can read and write .png files. If PyPNG is
+installed it is used (see http://pypi.python.org/pypi/pypng), otherwise
+a pure Python codec based on the standard library's zlib module is used;
+this can read all the standard non-interlaced PNG formats and writes
+8-bit RGBA files.
+
+Pixels are moved between PNG RGBA rows and the image's ARGB pixels a
+whole row at a time (using numpy byte views if numpy is installed).
 """
 
+import array
+import io
+import itertools
 import os
+import struct
 import sys
 import warnings
+import zlib
 import Image
 # These are due to issues with the png module
 if sys.version_info[:2] >= (3, 2):
@@ -32,13 +43,22 @@ try:
     import png
 except ImportError:
     png = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4} # Keyed by PNG color type
+# Byte offsets of the A, R, G and B components in a native uint32 pixel
+_A, _R, _G, _B = (3, 2, 1, 0) if sys.byteorder == "little" else (0, 1, 2, 3)
 
 
 def can_load(filename):
     """Returns 100 if this module can do a lossless load, 0 if it can't
     load the file, and something inbetween if it can do a lossy load."""
-    return (80 if png is not None and
-            os.path.splitext(filename)[1].lower() == ".png" else 0)
+    return 80 if os.path.splitext(filename)[1].lower() == ".png" else 0
 
 
 def can_save(filename):
@@ -47,29 +67,365 @@ def can_save(filename):
     return can_load(filename)
 
 
-if png is not None:
-    def load(image, filename):
-        """load a PNG file"""
-        reader = png.Reader(filename=filename)
-        image.width, image.height, pixels, _ = reader.asRGBA8()
-        image.pixels = Image.create_array(image.width, image.height)
-        index = 0
-        for row in pixels:
-            for r, g, b, α in zip(row[::4], row[1::4], row[2::4], row[3::4]):
-                image.pixels[index] = Image.color_for_argb(α, r, g, b)
-                index += 1
-
-
-    def save(image, filename):
-        """save a PNG file"""
-        with open(filename, "wb") as file:
-            writer = png.Writer(width=image.width, height=image.height,
-                    alpha=True)
-            writer.write_array(file, list(_rgba_for_pixels(image.pixels)))
-
-
-    def _rgba_for_pixels(pixels):
-        for color in pixels:
-            α, r, g, b = Image.argb_for_color(color)
-            for component in (r, g, b, α):
-                yield component
+def probe(filename):
+    """returns the PNG file's (width, height) reading only its header"""
+    with open(filename, "rb") as file:
+        data = file.read(len(_SIGNATURE) + 8 + 13)
+    if (len(data) != len(_SIGNATURE) + 8 + 13 or
+            not data.startswith(_SIGNATURE) or data[12:16] != b"IHDR"):
+        raise Image.Error("'{}' is not a PNG file".format(filename))
+    return struct.unpack(">II", data[16:24])
+
+
+def load(image, filename):
+    """load a PNG file"""
+    _load_rows(image, _rgba8_file_rows(filename))
+
+
+def decode(image, data, filename):
+    """load a PNG image from data, the bytes of a PNG file"""
+    _load_rows(image, _rgba8_file_rows(filename, io.BytesIO(data)))
+
+
+def _load_rows(image, rgba8):
+    image.width, image.height, rows = rgba8
+    image.pixels = Image.create_array(image.width, image.height)
+    if numpy is not None:
+        argb = image.as_array(channels=True)
+        for y, row in enumerate(rows):
+            argb[y] = numpy.asarray(row, dtype=numpy.uint8).reshape(
+                    image.width, 4)[:, (3, 0, 1, 2)]
+    else:
+        for y, row in enumerate(rows):
+            offset = y * image.width
+            image.pixels[offset:offset + image.width] = array.array(
+                    image.pixels.typecode, _argb_for_rgba(row))
+
+
+def read_rows(filename):
+    """returns the PNG file's width, height, and an iterator of its rows
+    of ARGB pixels; each row is only read and decoded when it is needed"""
+    width, height, rows = _rgba8_file_rows(filename)
+    return width, height, (_argb_row(row, width) for row in rows)
+
+
+def save(image, filename):
+    """save a PNG file"""
+    with open(filename, "wb") as file:
+        _write(file, image.width, image.height, _rgba_rows(image))
+
+
+def encode(image, filename):
+    """returns the bytes of the PNG file that save() would write"""
+    file = io.BytesIO()
+    _write(file, image.width, image.height, _rgba_rows(image))
+    return file.getvalue()
+
+
+def write_rows(filename, width, height, rows):
+    """save a PNG file whose pixels are given by an iterable of height
+    rows of width ARGB pixels each (as returned by read_rows()); each row
+    is compressed as soon as it is received"""
+    if numpy is not None:
+        rows = (numpy.ascontiguousarray(row, dtype=numpy.uint32).view(
+                numpy.uint8).reshape(width, 4)[:, (_R, _G, _B, _A)]
+                .tobytes() for row in rows)
+    else:
+        rows = (_rgba_for_argb(memoryview(row).cast("B")) for row in rows)
+    with open(filename, "wb") as file:
+        _write(file, width, height, rows)
+
+
+def _rgba8_file_rows(filename, file=None):
+    # Reads the file called filename unless an open file is given
+    if png is not None:
+        reader = (png.Reader(filename=filename) if file is None else
+                  png.Reader(file=file))
+        width, height, rows, _ = reader.asRGBA8()
+        return width, height, rows
+    return _read_rgba8(filename, file)
+
+
+def _write(file, width, height, rows):
+    if png is not None:
+        writer = png.Writer(width=width, height=height, greyscale=False,
+                alpha=True)
+        writer.write(file, rows)
+    else:
+        _write_rgba8(file, width, height, rows)
+
+
+def _argb_row(rgba, width):
+    # Returns a new row of ARGB pixels for the given RGBA bytes
+    row = Image.create_array(width, 1)
+    if numpy is not None:
+        row.view(numpy.uint8).reshape(width, 4)[:, (_R, _G, _B, _A)] = (
+                numpy.asarray(rgba, dtype=numpy.uint8).reshape(width, 4))
+    else:
+        row[:] = array.array(row.typecode, _argb_for_rgba(rgba))
+    return row
+
+
+def _rgba_rows(image):
+    # Yields each row of the image as RGBA bytes
+    if numpy is not None:
+        argb = image.as_array(channels=True)
+        for y in range(image.height):
+            yield argb[y][:, (1, 2, 3, 0)].tobytes()
+    else:
+        pixels = memoryview(image.pixels).cast("B")
+        size = image.width * 4
+        for offset in range(0, image.height * size, size):
+            yield _rgba_for_argb(pixels[offset:offset + size])
+
+
+def _argb_for_rgba(rgba):
+    argb = bytearray(len(rgba))
+    for target, source in ((_R, 0), (_G, 1), (_B, 2), (_A, 3)):
+        argb[target::4] = rgba[source::4]
+    return argb
+
+
+def _rgba_for_argb(argb):
+    rgba = bytearray(len(argb))
+    for target, source in ((0, _R), (1, _G), (2, _B), (3, _A)):
+        rgba[target::4] = argb[source::4]
+    return bytes(rgba)
+
+
+def _read_rgba8(filename, file=None):
+    # Returns the width, height, and an iterator of RGBA8 rows; the
+    # file is read a chunk at a time as the rows are consumed
+    file = open(filename, "rb") if file is None else file
+    try:
+        if file.read(len(_SIGNATURE)) != _SIGNATURE:
+            raise Image.Error("'{}' is not a PNG file".format(filename))
+        chunks = _chunks(file, filename)
+        header = palette = transparency = None
+        for kind, data in chunks:
+            if kind == b"IHDR":
+                header = data
+            elif kind == b"PLTE":
+                palette = data
+            elif kind == b"tRNS":
+                transparency = data
+            elif kind in {b"IDAT", b"IEND"}:
+                break
+        if header is None or len(header) != 13 or kind != b"IDAT":
+            raise Image.Error("missing PNG header or image data in "
+                    "'{}'".format(filename))
+        (width, height, depth, colorType, _, _,
+         interlace) = struct.unpack(">IIBBBBB", header)
+        if colorType not in _CHANNELS or depth not in {1, 2, 4, 8, 16}:
+            raise Image.Error("invalid PNG color type {} or bit depth "
+                    "{} in '{}'".format(colorType, depth, filename))
+        if interlace:
+            raise Image.Error("interlaced PNG files require PyPNG: "
+                    "'{}'".format(filename))
+    except Exception:
+        file.close()
+        raise
+    convert = _rgba8_converter(width, depth, colorType, palette,
+            transparency)
+    return width, height, _rgba8_rows(file, filename, chunks, data,
+            width, height, depth * _CHANNELS[colorType], convert)
+
+
+def _chunks(file, filename):
+    while True:
+        header = file.read(8)
+        if len(header) != 8:
+            raise Image.Error("truncated PNG file '{}'".format(filename))
+        length, kind = struct.unpack(">I4s", header)
+        data = file.read(length)
+        crc = file.read(4)
+        if (len(data) != length or len(crc) != 4 or
+                zlib.crc32(kind + data) != struct.unpack(">I", crc)[0]):
+            raise Image.Error("corrupt PNG chunk {} in '{}'".format(
+                    kind.decode("latin1"), filename))
+        yield kind, data
+        if kind == b"IEND":
+            break
+
+
+def _rgba8_rows(file, filename, chunks, data, width, height, bitsPerPixel,
+        convert):
+    with file:
+        stride = ((width * bitsPerPixel) + 7) // 8
+        bpp = max(1, bitsPerPixel // 8) # For filtering
+        previous = bytearray(stride)
+        buffer = bytearray()
+        y = 0
+        try:
+            for data in _inflated(chunks, data):
+                buffer += data
+                while len(buffer) > stride and y < height:
+                    line = _unfilter(buffer[0], buffer[1:stride + 1],
+                            previous, bpp)
+                    del buffer[:stride + 1]
+                    yield convert(line)
+                    previous = line
+                    y += 1
+        except zlib.error as err:
+            raise Image.Error("corrupt PNG image data in '{}': {}".format(
+                    filename, err))
+        if y != height:
+            raise Image.Error("truncated PNG image data in '{}'".format(
+                    filename))
+
+
+def _inflated(chunks, data):
+    decompressor = zlib.decompressobj()
+    yield decompressor.decompress(data)
+    for kind, data in chunks:
+        if kind == b"IDAT":
+            yield decompressor.decompress(data)
+    yield decompressor.flush()
+
+
+def _unfilter(kind, line, previous, bpp):
+    if kind == 1: # Sub
+        for i in range(bpp, len(line)):
+            line[i] = (line[i] + line[i - bpp]) & 0xFF
+    elif kind == 2: # Up
+        line = _add_bytes(line, previous)
+    elif kind == 3: # Average
+        for i in range(len(line)):
+            left = line[i - bpp] if i >= bpp else 0
+            line[i] = (line[i] + ((left + previous[i]) >> 1)) & 0xFF
+    elif kind == 4: # Paeth
+        for i in range(len(line)):
+            if i >= bpp:
+                a, c = line[i - bpp], previous[i - bpp]
+            else:
+                a = c = 0
+            b = previous[i]
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            line[i] = (line[i] + (a if pa <= pb and pa <= pc else
+                                  b if pb <= pc else c)) & 0xFF
+    elif kind != 0:
+        raise Image.Error("invalid PNG filter type {}".format(kind))
+    return line
+
+
+def _add_bytes(x, y):
+    # Adds each byte of y to the corresponding byte of x modulo 256 using
+    # whole-row int arithmetic: the low 7 bits of each byte are added
+    # without overflowing into the next byte, then the top bits xor'd in
+    size = len(x)
+    low = int.from_bytes(b"\x7F" * size, "big")
+    high = int.from_bytes(b"\x80" * size, "big")
+    x = int.from_bytes(x, "big")
+    y = int.from_bytes(y, "big")
+    return bytearray((((x & low) + (y & low)) ^ ((x ^ y) & high)).to_bytes(
+            size, "big"))
+
+
+def _rgba8_converter(width, depth, colorType, palette, transparency):
+    # Returns a function that takes an unfiltered line and returns its
+    # RGBA8 bytes; samples are rescaled to 8 bits the same way as PyPNG
+    channels = _CHANNELS[colorType]
+    count = width * channels
+    if colorType == 3:
+        table = [b"\x00\x00\x00\xFF"] * 256
+        alphas = transparency or b""
+        for i in range(len(palette or b"") // 3):
+            table[i] = palette[i * 3:i * 3 + 3] + (
+                    alphas[i:i + 1] or b"\xFF")
+        scale = None
+    else:
+        scale = _scale_table(depth)
+        if transparency is not None:
+            key = struct.unpack(">{}H".format(len(transparency) // 2),
+                    transparency)
+            key = key[0] if channels == 1 else key
+    white = b"\xFF" * width
+
+    def convert(line):
+        samples = _samples(line, count, depth)
+        if colorType == 3:
+            return bytearray(b"".join(map(table.__getitem__, samples)))
+        rgba = bytearray(width * 4)
+        if colorType in {0, 4}:
+            gray = _scaled(samples[::channels], scale, depth)
+            rgba[0::4] = rgba[1::4] = rgba[2::4] = gray
+        else:
+            for i in range(3):
+                rgba[i::4] = _scaled(samples[i::channels], scale, depth)
+        if colorType in {4, 6}:
+            rgba[3::4] = _scaled(samples[channels - 1::channels], scale,
+                    depth)
+        elif transparency is not None:
+            pixels = (samples if channels == 1 else
+                      zip(samples[0::3], samples[1::3], samples[2::3]))
+            rgba[3::4] = bytes(0 if pixel == key else 0xFF
+                               for pixel in pixels)
+        else:
+            rgba[3::4] = white
+        return rgba
+    return convert
+
+
+def _samples(line, count, depth):
+    if depth == 8:
+        return line[:count]
+    if depth == 16:
+        samples = array.array("H", bytes(line[:count * 2]))
+        if sys.byteorder == "little":
+            samples.byteswap()
+        return samples
+    return bytes(itertools.chain.from_iterable(map(
+            _unpacking_table(depth).__getitem__, line)))[:count]
+
+
+def _scaled(samples, scale, depth):
+    if depth == 8:
+        return samples
+    if depth == 16:
+        return bytes(map(scale.__getitem__, samples))
+    return bytes(samples).translate(scale)
+
+
+_ScaleTables = {}
+def _scale_table(depth):
+    table = _ScaleTables.get(depth)
+    if table is None:
+        factor = 0xFF / ((1 << depth) - 1)
+        table = bytes(int(round(value * factor))
+                      for value in range(1 << depth))
+        # translate() needs 256 entries even for 1, 2 and 4-bit samples
+        table = _ScaleTables[depth] = table.ljust(256, b"\x00")
+    return table
+
+
+_UnpackingTables = {}
+def _unpacking_table(depth):
+    # Maps each byte to the depth-bit samples it holds, leftmost first
+    table = _UnpackingTables.get(depth)
+    if table is None:
+        mask = (1 << depth) - 1
+        shifts = range(8 - depth, -1, -depth)
+        table = _UnpackingTables[depth] = [bytes((value >> shift) & mask
+                for shift in shifts) for value in range(256)]
+    return table
+
+
+def _write_rgba8(file, width, height, rows):
+    file.write(_SIGNATURE)
+    _write_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8,
+            6, 0, 0, 0))
+    compressor = zlib.compressobj()
+    for row in rows:
+        data = compressor.compress(b"\x00" + row) # Filter type None
+        if data:
+            _write_chunk(file, b"IDAT", data)
+    _write_chunk(file, b"IDAT", compressor.flush())
+    _write_chunk(file, b"IEND", b"")
+
+
+def _write_chunk(file, kind, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(kind + data)))
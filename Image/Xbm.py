@@ -12,8 +12,8 @@
 """
     import Image
 Use the above rather than importing this module explicitly. This works
-because Image imports any modules it finds (to allow for new image
-processing modules to be added post-facto).
+because Image's _Registry maps the .xbm suffix to this module, which Image
+imports on demand the first time a .xbm file is loaded, saved, or probed.
 
 This Image plugin module can read and write .xbm files.
 
@@ -22,11 +22,18 @@ the image's hotspot.
 """
 
 import io
+import itertools
 import mmap
 import os
 import sys
+import types
 import warnings
 import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    import array
 
 
 def can_load(filename):
@@ -51,16 +58,38 @@ _Y_HOT = b"y_hot"
 
 def load(image, filename):
     """load an XBM file"""
+    with open(filename, "rb") as file:
+        _load_data(image, mmap.mmap(file.fileno(), 0,
+                access=mmap.ACCESS_READ), filename)
+
+
+def decode(image, data, filename):
+    """load an XBM image from data, the bytes of an XBM file (as bytes or
+    any other buffer, e.g., a memoryview)"""
+    _load_data(image, bytes(data), filename)
+
+
+def _load_data(image, xbm, filename):
+    i = xbm.find(_DEFINE)
+    j = xbm.find(_BITS)
+    if i == -1 or j == -1:
+        raise Image.Error("failed to parse '{}'".format(filename))
+    _parse_defines(image, xbm[i:j])
+    _parse_bits(image, xbm[j + len(_BITS):])
+
+
+def probe(filename):
+    """returns the XBM file's (width, height) reading only its defines"""
     with open(filename, "rb") as file:
         xbm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
         i = xbm.find(_DEFINE)
         j = xbm.find(_BITS)
         if i == -1 or j == -1:
             raise Image.Error("failed to parse '{}'".format(filename))
-        _parse_defines(image, xbm[i:j])
-        image.pixels = Image.create_array(image.width, image.height,
-                Image.ColorForName["white"])
-        _parse_bits(image, xbm[j + len(_BITS):])
+        header = types.SimpleNamespace(width=None, height=None, meta={},
+                filename=filename)
+        _parse_defines(header, xbm[i:j])
+        return header.width, header.height
 
 
 def _parse_defines(image, defines):
@@ -81,24 +110,51 @@ def _parse_defines(image, defines):
 
 
 def _parse_bits(image, bits):
-    # Algorithm based on the one used by libclaw
+    # Each row is stored in (width + 7) // 8 bytes, least significant
+    # bit first; the padding bits past the width are ignored
     i = bits.find(b"{")
     j = bits.find(b"};", i)
     if i == -1 or j == -1:
         raise Image.Error("missing bits in '{}'".format(image.filename))
+    data = _bytes_for_bits(bits[i + 1:j].rstrip())
     black = Image.ColorForName["black"]
-    x = index = 0
-    for value in _values_for_bits(bits[i + 1:j].rstrip()):
-        i = 0
-        while i != 8 and x != image.width:
-            if value & 1:
-                image.pixels[index] = black
-            i += 1
-            index += 1
-            x += 1
-            value >>= 1
-        if x == image.width:
-            x = 0
+    white = Image.ColorForName["white"]
+    rowBytes = (image.width + 7) // 8
+    size = image.height * rowBytes
+    data = data[:size] + bytes(max(0, size - len(data)))
+    if numpy is not None:
+        data = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+                image.height, rowBytes)
+        isBlack = numpy.unpackbits(data, axis=1, bitorder="little")[
+                :, :image.width]
+        image.pixels = numpy.where(isBlack, numpy.uint32(black),
+                numpy.uint32(white)).ravel()
+    else:
+        image.pixels = Image.create_array(image.width, image.height)
+        colors = [array.array(image.pixels.typecode, (black if value &
+                  (1 << bit) else white for bit in range(8)))
+                  for value in range(256)]
+        for y in range(image.height):
+            offset = y * image.width
+            row = data[y * rowBytes:(y + 1) * rowBytes]
+            image.pixels[offset:offset + image.width] = array.array(
+                    image.pixels.typecode, itertools.chain.from_iterable(
+                    map(colors.__getitem__, row)))[:image.width]
+
+
+def _bytes_for_bits(bits):
+    # The usual case is a comma-separated list of 0xNN values which can
+    # be converted in one go; anything else is converted value by value
+    count = bits.count(b",") + (0 if bits.endswith(b",") else 1)
+    digits = bits.translate(None, b" \t\r\n,")
+    if (bits.count(b"0x") + bits.count(b"0X") == count and
+            len(digits) == 4 * count):
+        try:
+            return bytes.fromhex(digits.replace(b"0x", b"").replace(
+                    b"0X", b"").decode("ascii"))
+        except ValueError:
+            pass
+    return bytes(value & 0xFF for value in _values_for_bits(bits))
 
 
 def _values_for_bits(bits):
@@ -122,6 +178,14 @@ def save(image, filename):
         _write_pixels(image, file)
 
 
+def encode(image, filename):
+    """returns the bytes of the XBM file that save() would write"""
+    file = io.StringIO()
+    _write_header(image, file, Image.sanitized_name(filename))
+    _write_pixels(image, file)
+    return file.getvalue().encode("ascii")
+
+
 def _write_header(image, file, name):
     file.write("#define {}_width {}\n".format(name, image.width))
     file.write("#define {}_height {}\n".format(name, image.height))
@@ -134,38 +198,29 @@ def _write_header(image, file, name):
 
 
 def _write_pixels(image, file):
-    # Algorithm based on the one used by libclaw
+    # Each row is packed into (width + 7) // 8 bytes, least significant
+    # bit first
     white = Image.ColorForName["white"]
     transparent = Image.ColorForName["transparent"]
+    if numpy is not None:
+        pixels = image.as_array()
+        isBlack = (pixels != white) & (pixels != transparent)
+        data = numpy.packbits(isBlack, axis=1, bitorder="little").tobytes()
+    else:
+        data = bytearray()
+        for y in range(image.height):
+            offset = y * image.width
+            bits = "".join("0" if color in {white, transparent} else "1"
+                    for color in image.pixels[offset:offset + image.width])
+            data.extend(int(bits[x:x + 8][::-1], 2)
+                        for x in range(0, len(bits), 8))
     MAX_PER_LINE = 12
-    count = index = 0
-    for y in range(image.height):
-        x = 0
-        while x != image.width:
-            value = bits = 0
-            while x != image.width and bits != 8:
-                value >>= 1
-                if image.pixel(x, y) not in {white, transparent}:
-                    value |= 0x80
-                bits += 1
-                x += 1
-                index += 1
-            value >>= 8 - bits
-            count += 1
-            file.write("0x{:02X}".format(value))
-            if index != len(image.pixels):
-                if count == MAX_PER_LINE:
-                    file.write(",\n  ")
-                    count = 0
-                else:
-                    file.write(", ")
-    # remove spurious trailing comma
-    BACK = 3
-    offset = file.tell() - BACK
-    file.seek(offset, io.SEEK_SET)
-    chunk = file.read(BACK)
-    i = chunk.find(",")
-    if i > -1:
-        file.seek(file.tell() - (BACK - i), io.SEEK_SET)
+    separator = ""
+    for i in range(0, len(data), MAX_PER_LINE):
+        file.write(separator + ", ".join(map(_HEX.__getitem__,
+                data[i:i + MAX_PER_LINE])))
+        separator = ",\n  "
     file.write("};\n")
-    file.truncate()
+
+
+_HEX = ["0x{:02X}".format(value) for value in range(256)]
@@ -12,8 +12,8 @@
 """
     import Image
 Use the above rather than importing this module explicitly. This works
-because Image imports any modules it finds (to allow for new image
-processing modules to be added post-facto).
+because Image's _Registry maps the .xpm suffix to this module, which Image
+imports on demand the first time a .xpm file is loaded, saved, or probed.
 
 This Image plugin module can read and write .xpm files.
 
@@ -30,8 +30,15 @@ the image's hotspot.
 import io
 import itertools
 import os
+import tempfile
+import types
 import warnings
 import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    import array
 
 
 _XPM = "/* XPM */"
@@ -54,37 +61,240 @@ def can_save(filename):
 
 
 def load(image, filename):
-    """load an XPM file"""
-    colors = cpp = count = None
-    state = _WANT_XPM
+    """load an XPM file
+
+    The header and palette are parsed line by line, but the pixel rows
+    are decoded in bulk. If any pixel row is irregular the whole file is
+    reparsed line by line so that errors are reported just as before."""
+    with open(filename, "rt", encoding="ascii") as file:
+        _load_text(image, file.read())
+
+
+def decode(image, data, filename):
+    """load an XPM image from data, the bytes of an XPM file"""
+    # Read as a text file so that line endings are handled just as load()
+    # handles them
+    with io.TextIOWrapper(io.BytesIO(data), encoding="ascii") as file:
+        _load_text(image, file.read())
+
+
+def _load_text(image, text):
     palette = {}
-    index = 0
+    lines = text.split("\n")
+    cpp, lino = _parse_header(enumerate(lines, start=1), image, palette)
+    if image.width is not None:
+        image.pixels = Image.create_array(image.width, image.height)
+    if cpp is not None:
+        rows = _pixel_rows(lines, lino, image.height, image.width * cpp)
+        if rows is None:
+            _load_lines(image, lines)
+        else:
+            _decoder(palette, cpp)(image.pixels, "".join(rows))
+
+
+def read_rows(filename):
+    """returns the XPM file's width, height, and an iterator of its rows
+    of pixels; each row is only read and decoded when it is needed"""
+    file = open(filename, "rt", encoding="ascii")
+    try:
+        header = types.SimpleNamespace(width=None, height=None, meta={})
+        palette = {}
+        lines = enumerate(file, start=1)
+        cpp, _ = _parse_header(lines, header, palette)
+        if cpp is None:
+            raise Image.Error("missing XPM pixels in '{}'".format(
+                    filename))
+    except Exception:
+        file.close()
+        raise
+    return header.width, header.height, _decoded_rows(file, filename,
+            lines, header.width, header.height, cpp,
+            _decoder(palette, cpp))
+
+
+def _parse_header(lines, image, palette):
+    # Parses the (lino, line) pairs up to the end of the palette and
+    # returns the cpp and the lino of the palette's last line, or
+    # (None, None) if the palette is incomplete
+    cpp = count = None
+    state = _WANT_XPM
+    for lino, line in lines:
+        line = line.strip()
+        if not line or (line.startswith(("/*", "//")) and state !=
+                _WANT_XPM):
+            continue
+        if state == _WANT_COLOR:
+            count, state = _parse_color(lino, line, palette, cpp,
+                    count)
+            if state == _WANT_PIXELS:
+                return cpp, lino
+        elif state == _WANT_XPM:
+            state = _parse_xpm(lino, line)
+        elif state == _WANT_NAME:
+            state = _parse_name(lino, line)
+        elif state == _WANT_VALUES:
+            _, cpp, count, state = _parse_values(lino, line, image)
+            if not count:
+                return cpp, lino
+    return None, None
+
+
+def _decoded_rows(file, filename, lines, width, height, cpp, decode):
+    with file:
+        y = 0
+        for lino, line in lines:
+            if y == height:
+                break
+            line = line.strip()
+            if not line or line.startswith(("/*", "//")):
+                continue
+            codes = _sanitize_quoted_line(lino, line)
+            if len(codes) != width * cpp:
+                raise Image.Error("invalid XPM file line {}: expected {} "
+                        "pixels".format(lino, width))
+            row = Image.create_array(width, 1)
+            decode(row, codes)
+            yield row
+            y += 1
+        if y != height:
+            raise Image.Error("missing XPM pixel rows in '{}'".format(
+                    filename))
+
+
+def probe(filename):
+    """returns the XPM file's (width, height) reading only its header"""
+    header = types.SimpleNamespace(width=None, height=None, meta={})
+    state = _WANT_XPM
     with open(filename, "rt", encoding="ascii") as file:
         for lino, line in enumerate(file, start=1):
             line = line.strip()
             if not line or (line.startswith(("/*", "//")) and state !=
                     _WANT_XPM):
                 continue
-            # if branches are ordered by frequency of occurrence
-            if state == _WANT_COLOR:
-                count, state = _parse_color(lino, line, palette, cpp,
-                        count)
-                if state == _WANT_PIXELS:
-                    count = image.height
-            elif state == _WANT_PIXELS:
-                count, state, index = _parse_pixels(lino, line,
-                        image.pixels, palette, cpp, count, index)
-                if state == _DONE:
-                    break
-            elif state == _WANT_XPM:
+            if state == _WANT_XPM:
                 state = _parse_xpm(lino, line)
             elif state == _WANT_NAME:
                 state = _parse_name(lino, line)
-            elif state == _WANT_VALUES:
-                colors, cpp, count, state = _parse_values(lino, line,
-                        image)
-                image.pixels = Image.create_array(image.width,
-                        image.height)
+            else:
+                _parse_values(lino, line, header)
+                return header.width, header.height
+    raise Image.Error("missing XPM values in '{}'".format(filename))
+
+
+def _pixel_rows(lines, start, height, length):
+    # Returns the unquoted pixel rows that follow the palette, or None if
+    # any of them is malformed or isn't exactly length characters long
+    if not height:
+        return None
+    rows = []
+    for line in itertools.islice(lines, start, None):
+        line = line.strip()
+        if not line or line.startswith(("/*", "//")):
+            continue
+        line = line.rstrip(",};")
+        if (len(line) != length + 2 or not (line.startswith('"') and
+                line.endswith('"'))):
+            return None
+        rows.append(line[1:-1])
+        if len(rows) == height:
+            break
+    return rows
+
+
+def _decoder(palette, cpp):
+    # Returns a function that decodes a str of cpp-wide codes into the
+    # given pixels. Unknown codes raise a KeyError for the first one,
+    # just like a palette[code] lookup would
+    keys = sorted(palette)
+    if numpy is not None and cpp <= 8:
+        # Each cpp-wide code is packed big-endian into an int: for up to
+        # 2 cpp these index a lookup table directly, otherwise they are
+        # looked up in the sorted palette codes
+        keys = [key for key in keys if len(key) == cpp]
+        colors = numpy.array([palette[key] for key in keys],
+                dtype=numpy.uint32)
+        numbers = numpy.array([int.from_bytes(key.encode("ascii"), "big")
+                for key in keys], dtype=numpy.uint64)
+        if cpp <= 2:
+            table = numpy.zeros(256 ** cpp, dtype=numpy.intp)
+            known = numpy.zeros(256 ** cpp, dtype=bool)
+            table[numbers] = numpy.arange(len(numbers))
+            known[numbers] = True
+
+        def decode(pixels, codes):
+            data = numpy.frombuffer(codes.encode("ascii"),
+                    dtype=numpy.uint8).reshape(-1, cpp)
+            values = numpy.zeros(len(data), dtype=numpy.uint64)
+            for column in range(cpp):
+                values = (values << numpy.uint64(8)) | data[:, column]
+            if cpp <= 2:
+                indexes = table[values]
+                found = known[values]
+            else:
+                indexes = numpy.minimum(numpy.searchsorted(numbers,
+                        values), max(len(numbers) - 1, 0))
+                found = (numbers[indexes] == values if len(numbers) else
+                        numpy.zeros(len(values), dtype=bool))
+            if not found.all():
+                i = int(numpy.argmin(found)) * cpp
+                raise KeyError(codes[i:i + cpp])
+            pixels[:len(values)] = colors[indexes]
+    elif cpp == 1:
+        # bytes.translate() maps every code to its palette index in C
+        table = bytearray([0xFF]) * 256 # 0xFF marks unknown codes
+        for index, key in enumerate(keys):
+            if len(key) == 1:
+                table[ord(key)] = index
+        colors = [palette[key] for key in keys]
+
+        def decode(pixels, codes):
+            indexes = codes.encode("ascii").translate(table)
+            if 0xFF in indexes:
+                raise KeyError(codes[indexes.index(0xFF)])
+            pixels[:len(indexes)] = array.array(pixels.typecode,
+                    map(colors.__getitem__, indexes))
+    else:
+        def decode(pixels, codes):
+            colors = [palette[codes[i:i + cpp]]
+                    for i in range(0, len(codes), cpp)]
+            pixels[:len(colors)] = (colors if numpy is not None else
+                    array.array(pixels.typecode, colors))
+    return decode
+
+
+def _load_lines(image, lines):
+    # The original line by line state machine: used for irregular files
+    image.width = image.height = None
+    image.meta = {}
+    colors = cpp = count = None
+    state = _WANT_XPM
+    palette = {}
+    index = 0
+    for lino, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or (line.startswith(("/*", "//")) and state !=
+                _WANT_XPM):
+            continue
+        # if branches are ordered by frequency of occurrence
+        if state == _WANT_COLOR:
+            count, state = _parse_color(lino, line, palette, cpp,
+                    count)
+            if state == _WANT_PIXELS:
+                count = image.height
+        elif state == _WANT_PIXELS:
+            count, state, index = _parse_pixels(lino, line,
+                    image.pixels, palette, cpp, count, index)
+            if state == _DONE:
+                break
+        elif state == _WANT_XPM:
+            state = _parse_xpm(lino, line)
+        elif state == _WANT_NAME:
+            state = _parse_name(lino, line)
+        elif state == _WANT_VALUES:
+            colors, cpp, count, state = _parse_values(lino, line,
+                    image)
+            image.pixels = Image.create_array(image.width,
+                    image.height)
 
 
 def _parse_xpm(lino, line):
@@ -157,65 +367,135 @@ def _sanitize_quoted_line(lino, line):
 
 
 def save(image, filename):
-    """save an XPM file"""
-    name = Image.sanitized_name(filename)
-    palette, cpp = _palette_and_cpp(image.pixels)
-    with open(filename, "w+t", encoding="ascii") as file:
-        _write_header(image, file, name, cpp, len(palette))
-        _write_palette(file, palette)
-        _write_pixels(image, file, palette)
-
-
-def _palette_and_cpp(pixels):
+    """save an XPM file
+
+    The distinct colors are found in one pass and each row of pixel
+    codes is written as a single bytes object."""
+    colors, indexes = _colors_and_indexes(image.pixels)
+    codes = _codes(len(colors))
+    with open(filename, "wb") as file:
+        _write(image, file, filename, colors, codes, _code_rows(image,
+                colors, codes, indexes))
+
+
+def encode(image, filename):
+    """returns the bytes of the XPM file that save() would write"""
+    colors, indexes = _colors_and_indexes(image.pixels)
+    codes = _codes(len(colors))
+    file = io.BytesIO()
+    _write(image, file, filename, colors, codes, _code_rows(image, colors,
+            codes, indexes))
+    return file.getvalue()
+
+
+def write_rows(filename, width, height, rows):
+    """save an XPM file whose pixels are given by an iterable of height
+    rows of width ARGB ints each
+
+    Since the palette precedes the pixels the rows are spooled to a
+    temporary file while the colors are collected, so only one row (and
+    the palette) is ever held in memory. The file is the same as save()
+    would produce for the equivalent image."""
     colors = set()
-    transparent = Image.ColorForName["transparent"]
-    for color in pixels:
-        if color == transparent:
-            name = "None" # special-case transparent
-        else: # strip off alpha
-            name = "#{:06X}".format(color & Image.CLEAR_ALPHA)
-        colors.add((color, name))
+    size = None
+    with tempfile.TemporaryFile() as spool:
+        for row in rows:
+            colors.update(numpy.unique(row).tolist() if numpy is not None
+                          else row)
+            data = row.tobytes()
+            size = len(data)
+            spool.write(data)
+        colors = sorted(colors)
+        codes = _codes(len(colors))
+        spool.seek(0)
+        if numpy is not None:
+            table = _code_table(codes)
+            colorArray = numpy.array(colors, dtype=numpy.uint32)
+            rows = (table[numpy.searchsorted(colorArray, numpy.frombuffer(
+                    spool.read(size), dtype=numpy.uint32))].tobytes()
+                    for _ in range(height))
+        else:
+            codeForColor = {color: code.encode("ascii")
+                            for color, code in zip(colors, codes)}
+            typecode = Image.create_array(0, 0).typecode
+            rows = (b"".join(map(codeForColor.__getitem__, array.array(
+                    typecode, spool.read(size)))) for _ in range(height))
+        header = types.SimpleNamespace(width=width, height=height, meta={})
+        with open(filename, "wb") as file:
+            _write(header, file, filename, colors, codes, rows)
+
+
+def _code_rows(image, colors, codes, indexes):
+    # Returns an iterator of each row of pixel codes as a bytes object
+    offsets = (y * image.width for y in range(image.height))
+    if indexes is not None:
+        table = _code_table(codes)
+        return (table[indexes[offset:offset + image.width]].tobytes()
+                for offset in offsets)
+    codeForColor = {color: code.encode("ascii")
+                    for color, code in zip(colors, codes)}
+    return (b"".join(map(codeForColor.__getitem__,
+            image.pixels[offset:offset + image.width]))
+            for offset in offsets)
+
+
+def _colors_and_indexes(pixels):
+    # Returns the sorted distinct colors and, with numpy, the index into
+    # them of every pixel
+    if numpy is not None:
+        colors, indexes = numpy.unique(numpy.asarray(pixels,
+                dtype=numpy.uint32), return_inverse=True)
+        return colors.tolist(), indexes.ravel()
+    return sorted(set(pixels)), None
+
+
+def _codes(count):
+    # Colors are given codes in ascending order so that we get the same
+    # codes every time (this doesn't matter for the format but helps
+    # with regressions testing)
     cpp = 1
-    while True:
-        if len(colors) <= len(_CODES) ** cpp:
-            break
+    while count > len(_CODES) ** cpp:
         cpp += 1
-    # we turn the colors into a list so that we get the same order every
-    # time (this doesn't matter for the format but helps with
-    # regressions testing)
-    colors = sorted(colors, reverse=True)
-    palette = {}
-    for code in itertools.product(_CODES, repeat=cpp):
-        if not colors:
-            break
-        color, name = colors.pop()
-        palette[color] = ("".join(code), name)
-    return palette, cpp
+    return ["".join(code) for code in itertools.islice(
+            itertools.product(_CODES, repeat=cpp), count)]
+
+
+def _code_table(codes):
+    return numpy.array([code.encode("ascii") for code in codes],
+            dtype="S{}".format(len(codes[0]) if codes else 1))
+
+
+def _write(image, file, filename, colors, codes, rows):
+    cpp = len(codes[0]) if codes else 1
+    _write_header(image, file, Image.sanitized_name(filename), cpp,
+            len(colors))
+    _write_palette(file, colors, codes)
+    for row in rows:
+        file.write(b'"' + row + b'",\n')
+    file.seek(file.tell() - 2, io.SEEK_SET) # Get rid of spurious ,\n
+    file.write(b"};\n")
 
 
 def _write_header(image, file, name, cpp, colors):
-    file.write("{}\nstatic unsigned char *{}[] = {{\n".format(_XPM, name))
-    file.write('"{} {} {} {}'.format(image.width, image.height, colors,
-        cpp))
+    header = "{}\nstatic unsigned char *{}[] = {{\n".format(_XPM, name)
+    header += '"{} {} {} {}'.format(image.width, image.height, colors,
+        cpp)
     x = image.meta.get("x_hot")
     y = image.meta.get("y_hot")
     if x is not None and y is not None:
-        file.write(" {} {}".format(x, y))
-    file.write('",\n')
+        header += " {} {}".format(x, y)
+    file.write((header + '",\n').encode("ascii"))
 
 
-def _write_palette(file, palette):
-    for code, name in sorted(palette.values(),
+def _write_palette(file, colors, codes):
+    transparent = Image.ColorForName["transparent"]
+    palette = []
+    for color, code in zip(colors, codes):
+        if color == transparent:
+            name = "None" # special-case transparent
+        else: # strip off alpha
+            name = "#{:06X}".format(color & Image.CLEAR_ALPHA)
+        palette.append((code, name))
+    for code, name in sorted(palette,
             key=lambda v: " " if v[1] == "None" else v[1]):
-        file.write('"{}\tc {}",\n'.format(code, name)) # \t is nicer in vim
-
-
-def _write_pixels(image, file, palette):
-    for y in range(image.height):
-        file.write('"')
-        for x in range(image.width):
-            code = palette[image.pixel(x, y)][0]
-            file.write(code)
-        file.write('",\n')
-    file.seek(file.tell() - 2, io.SEEK_SET) # Get rid of spurious ,\n
-    file.write("};\n")
+        file.write('"{}\tc {}",\n'.format(code, name).encode("ascii"))
@@ -15,10 +15,18 @@ A framework for image processing.
 Images are stored in instances of the Image class. The data is stored as
 ARGB colors in a numpy.array() with dtype uint32 or if numpy isn't
 installed in an array.array("I") or array.array("L"), whichever is
-needed for 32-bit values.
+needed for 32-bit values. With numpy, Image.as_array() gives zero-copy
+(height, width) and (height, width, 4) views of the data, and on Python
+3.12+ an Image can be passed directly to memoryview(). For integer
+arithmetic on whole images Image.as_planes() gives exact uint16 A, R, G,
+B planes, optionally premultiplied by alpha, and Image.from_planes()
+packs them back into ARGB pixels.
 
 Supporting modules provide the ability to load/save files in particular
-image formats (see Xbm.py and Xpm.py).
+image formats (see Xbm.py and Xpm.py). Modules are only imported when
+they are needed: the standard ones are registered by suffix in
+_Registry, and any others in this directory are imported the first time
+a file is loaded or saved, so importing Image itself stays cheap.
 
 Every module *must* provide can_save(filename) and can_load(filename)
 functions: these should return a value between 0 (can't) and 100 (can to
@@ -27,17 +35,36 @@ filename) functions. If you want to override an existing module (e.g.,
 Xbm.py, just create a new one, say, Xbm2.py, and make sure its
 can_load() and can_save() functions return higher values than the Xpm.py
 module. (All standard modules return 100 or less for what they can and 0
-for what they can't.)
+for what they can't.) Modules may also provide a probe(filename)
+function that returns the image's (width, height) by reading only the
+file's header; see probe() and ProbeCache. Modules may also provide
+read_rows(filename), which returns the width, height, and an iterator of
+rows of pixels, and write_rows(filename, width, height, rows): these let
+scale_file() and subsample_file() work on images too big for memory.
+And modules may provide decode(image, data, filename) and encode(image,
+filename) functions that load from, and return, the bytes of a file
+called filename without touching the disk; see from_bytes() and
+to_bytes().
 
 Rather than creating Images directly, use one of the construction
-functions, create(), from_file(), or from_data().
+functions, create(), from_file(), from_bytes(), or from_data().
+
+scale(), subsample(), and resample() use the fastest implementation
+available: the compiled Cython Scale.Fast module (if built), else numpy,
+else pure Python; see backend() to find out which or to override the
+choice.
 
 For sophisticated image processing install numpy _and_ scipy and use
 the scipy image processing functions.
 """
 
 import collections
+import contextlib
+import functools
 import importlib
+import itertools
+import json
+import math
 import os
 import re
 import sys
@@ -53,21 +80,47 @@ CLEAR_ALPHA = 0x00FFFFFF # & to ARGB color int to get rid of alpha channel
 MAX_ARGB = 0xFFFFFFFF
 MAX_COMPONENT = 0xFF
 SOLID = 0xFF000000 # + to RGB color int to get a solid ARGB color int
+# Image.draw() command kinds; NO_COLOR is for an absent outline or fill
+LINE, RECTANGLE, ELLIPSE = range(3)
+NO_COLOR = -1
 
 
 class Error(Exception): pass
 
 
-_Modules = []
-for name in os.listdir(os.path.dirname(__file__)):
-    if not name.startswith("_") and name.endswith(".py"):
-        name = "." + os.path.splitext(name)[0]
-        try:
-            module = importlib.import_module(name, "Image")
-            _Modules.append(module)
-        except ImportError as err:
-            warnings.warn("failed to load Image module: {}".format(err))
-del name, module
+# Describes a block of shared memory holding height rows of width values
+# of the given numpy-style dtype; see Image.share() and share_bytes().
+# Creating a block registers it with multiprocessing's resource tracker,
+# which takes a lock, so a program whose threads create blocks mustn't
+# fork processes meanwhile (and a ProcessPoolExecutor may start its
+# processes in any submit()): use a "forkserver" or "spawn"
+# multiprocessing context instead
+SharedBuffer = collections.namedtuple("SharedBuffer",
+        "name width height dtype")
+# On Windows a shared memory block is destroyed as soon as no process has
+# it open so it can't outlive its creator's handle; there the payload
+# itself is passed (and pickled) instead of a SharedBuffer
+_SHARE_MEMORY = os.name == "posix"
+_ITEMSIZE = {"uint8": 1, "uint32": 4}
+
+
+# The standard modules by the suffix they handle: each is only imported
+# when a file with its suffix is first loaded, saved, or probed. Any
+# other modules in this directory are imported the first time a module
+# is chosen since they might handle any suffix.
+_Registry = {".argb": "Argb", ".png": "Png", ".xbm": "Xbm", ".xpm": "Xpm"}
+_Modules = {} # Keyed by module name; None if it failed to import
+_Unregistered = None # The names of the other modules once listed
+
+# The compiled Cython scale() and resample() if they have been built;
+# see Scale/setup.py
+_cython_scale = _cython_resample = None
+if numpy is not None:
+    try:
+        from Scale.Fast import scale as _cython_scale
+        from Scale.Fast import resample as _cython_resample
+    except ImportError:
+        pass
 
 
 class Image:
@@ -102,6 +155,13 @@ class Image:
         return Class(filename=filename)
 
 
+    @classmethod
+    def from_bytes(Class, data, filename):
+        image = Class(width=0, height=0)
+        image.decode(data, filename)
+        return image
+
+
     @classmethod
     def create(Class, width, height, background=None):
         return Class(width=width, height=height, background=background)
@@ -141,11 +201,56 @@ class Image:
                     os.path.splitext(filename)[1]))
 
 
+    def decode(self, data, filename):
+        """loads the image from data, the contents of a file called
+        filename; the format is determined by the file suffix and
+        nothing is read from disk unless the format's module can't
+        decode bytes"""
+        module = Image._choose_module("can_load", filename)
+        if module is None:
+            raise Error("no Image module can load files of type {}".format(
+                    os.path.splitext(filename)[1]))
+        self.width = self.height = None
+        self.meta = {}
+        decode = getattr(module, "decode", None)
+        if decode is not None:
+            decode(self, data, filename)
+        else: # Named like filename so that the same module is chosen
+            import tempfile # Imported here as it's rarely needed
+            with tempfile.TemporaryDirectory() as directory:
+                spool = os.path.join(directory, os.path.basename(filename))
+                with open(spool, "wb") as file:
+                    file.write(data)
+                module.load(self, spool)
+        self.filename = filename
+
+
+    def to_bytes(self, filename=None):
+        """returns the contents the image would have if saved to a file
+        called filename; the format is determined by the file suffix"""
+        filename = filename if filename is not None else self.filename
+        if not filename:
+            raise Error("can't encode without a filename")
+        module = Image._choose_module("can_save", filename)
+        if module is None:
+            raise Error("no Image module can save files of type {}".format(
+                    os.path.splitext(filename)[1]))
+        encode = getattr(module, "encode", None)
+        if encode is not None:
+            return encode(self, filename)
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            spool = os.path.join(directory, os.path.basename(filename))
+            module.save(self, spool)
+            with open(spool, "rb") as file:
+                return file.read()
+
+
     @staticmethod
     def _choose_module(actionName, filename):
         bestRating = 0
         bestModule = None
-        for module in _Modules:
+        for module in _modules_for(os.path.splitext(filename)[1].lower()):
             action = getattr(module, actionName, None)
             if action is not None:
                 rating = action(filename)
@@ -167,11 +272,41 @@ class Image:
         self.pixels[(y * self.width) + x] = color
 
 
+    def fill_span(self, x0, x1, y, color, blend=False):
+        """sets the pixels on row y from x0 to x1 inclusive (in either
+        order) to the given color using a single slice assignment; if
+        blend is True the color is composited over the pixels using its
+        alpha instead; the coordinates must be in range; color must be
+        an ARGB int"""
+        if x0 > x1:
+            x0, x1 = x1, x0
+        start = (y * self.width) + x0
+        end = (y * self.width) + x1 + 1
+        if blend and (color >> 24) != MAX_COMPONENT:
+            if color >> 24: # Fully transparent colors change nothing
+                self.pixels[start:end] = _over(color,
+                        self.pixels[start:end])
+        elif numpy is not None:
+            self.pixels[start:end] = color
+        else:
+            self.pixels[start:end] = array.array(self.pixels.typecode,
+                    [color]) * (end - start)
+
+
     # Bresenham's mid-point line scanning algorithm from 
     # http://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm 
     def line(self, x0, y0, x1, y1, color):
         """draws the line in the given color; the coordinates must be in
         range; the color must be an ARGB int"""
+        if y0 == y1:
+            self.fill_span(x0, x1, y0, color)
+            return
+        if x0 == x1 and numpy is not None:
+            if y0 > y1:
+                y0, y1 = y1, y0
+            self.pixels[(y0 * self.width) + x0:(y1 * self.width) + x0 + 1:
+                    self.width] = color
+            return
         Δx = abs(x1 - x0)
         Δy = abs(y1 - y0)
         xInc = 1 if x0 < x1 else -1
@@ -190,12 +325,16 @@ class Image:
                 y0 += yInc
 
 
-    def rectangle(self, x0, y0, x1, y1, outline=None, fill=None):
+    def rectangle(self, x0, y0, x1, y1, outline=None, fill=None,
+            blend=False):
         """draws a rectangle outline if outline is not None and fill is
         None, or a filled rectangle if outline is None and fill is not
         None, or an outlined and filled rectangle if both are not None;
         the coordinates must be in range; the outline and fill colors
-        must be ARGB ints"""
+        must be ARGB ints; if blend is True the fill is composited over
+        the existing pixels using its alpha
+
+        The fill is done a span (row) at a time."""
         assert outline is not None or fill is not None
         if fill is not None:
             if y0 > y1:
@@ -205,8 +344,13 @@ class Image:
                 x1 -= 1
                 y0 += 1
                 y1 -= 1
-            for y in range(y0, y1 + 1):
-                self.line(x0, y, x1, y, fill)
+            left, right = min(x0, x1), max(x0, x1)
+            if (numpy is not None and not blend and y0 <= y1 and
+                    0 <= left and right < self.width):
+                self.as_array()[y0:y1 + 1, left:right + 1] = fill
+            else:
+                for y in range(y0, y1 + 1):
+                    self.fill_span(x0, x1, y, fill, blend)
         if outline is not None:
             self.line(x0, y0, x1, y0, outline)
             self.line(x1, y0, x1, y1, outline)
@@ -214,12 +358,16 @@ class Image:
             self.line(x0, y1, x0, y0, outline)
 
 
-    def ellipse(self, x0, y0, x1, y1, outline=None, fill=None):
+    def ellipse(self, x0, y0, x1, y1, outline=None, fill=None,
+            blend=False):
         """draws an ellipse outline if outline is not None and fill is
         None, or a filledn ellipse if outline is None and fill is not
         None, or an outlined and filledn ellipse if both are not None;
         the coordinates must be in range; the outline and fill colors
-        must be ARGB ints"""
+        must be ARGB ints; if blend is True the fill is composited over
+        the existing pixels using its alpha
+
+        The fill is done a span (row) at a time."""
         assert outline is not None or fill is not None
         if x0 > x1:
             x0, x1 = x1, x0
@@ -231,17 +379,27 @@ class Image:
             # Algorithm based on
             # http://stackoverflow.com/questions/10322341/
             # simple-algorithm-for-drawing-filled-ellipse-in-c-c
+            # Each row's pixels are those where inside() is true: this is
+            # a single span since inside() only gets false as |x| grows
             halfWidth = width // 2
             halfHeight = height // 2
             midX = x0 + halfWidth
             midY = y0 + halfHeight
+            def inside(x, y):
+                Δx =  x / halfWidth
+                Δy =  y / halfHeight
+                return ((Δx * Δx) + (Δy * Δy)) <= 1
             for y in range(-halfHeight, halfHeight + 1):
-                for x in range(-halfWidth, halfWidth + 1):
-                    Δx =  x / halfWidth
-                    Δy =  y / halfHeight
-                    if ((Δx * Δx) + (Δy * Δy)) <= 1:
-                        self.set_pixel(int(round(midX + x)),
-                                       int(round(midY + y)), fill)
+                Δy = y / halfHeight
+                x = min(halfWidth, int(halfWidth * math.sqrt(max(0,
+                        1 - (Δy * Δy)))))
+                while x < halfWidth and inside(x + 1, y):
+                    x += 1
+                while x > 0 and not inside(x, y):
+                    x -= 1
+                if inside(x, y):
+                    self.fill_span(midX - x, midX + x, midY + y, fill,
+                            blend)
         if outline is not None:
             # Midpoint ellipse algorithm from "Computer Graphics
             # Principles and Practice".
@@ -291,7 +449,86 @@ class Image:
                 ellipse_point(Δx, Δy)
 
 
-    def subsample(self, stride):
+    def draw(self, commands):
+        """draws all the commands
+
+        commands is either a sequence of (kind, x0, y0, x1, y1, outline,
+        fill) tuples or an equivalent (n, 7) numpy integer array. kind
+        is LINE, RECTANGLE, or ELLIPSE; the outline and fill are ARGB
+        ints or None or NO_COLOR (a line is drawn in its outline color).
+        This is the same as calling line(), rectangle() and ellipse()
+        for each command in turn; cyImage's draw() does it in a single
+        compiled loop."""
+        if numpy is not None and isinstance(commands, numpy.ndarray):
+            commands = commands.reshape(-1, 7).tolist()
+        for kind, x0, y0, x1, y1, outline, fill in commands:
+            outline = None if outline == NO_COLOR else outline
+            fill = None if fill == NO_COLOR else fill
+            if kind == LINE:
+                self.line(x0, y0, x1, y1, outline)
+            elif kind == RECTANGLE:
+                self.rectangle(x0, y0, x1, y1, outline, fill)
+            elif kind == ELLIPSE:
+                self.ellipse(x0, y0, x1, y1, outline, fill)
+            else:
+                raise Error("invalid draw command kind {}".format(kind))
+
+
+    def crop(self, x0, y0, x1, y1):
+        """returns a new image of the pixels from (x0, y0) up to but not
+        including (x1, y1), clipped to this image"""
+        x0, x1 = (min(max(0, x), self.width) for x in (x0, x1))
+        y0, y1 = (min(max(0, y), self.height) for y in (y0, y1))
+        width = max(0, x1 - x0)
+        height = max(0, y1 - y0)
+        if not (width and height):
+            return self.create(width, height)
+        if numpy is not None:
+            return self.from_data(width, self.as_array()[y0:y1,
+                    x0:x1].ravel().copy())
+        pixels = create_array(0, 0)
+        for y in range(y0, y1):
+            offset = y * self.width
+            pixels += self.pixels[offset + x0:offset + x1]
+        return self.from_data(width, pixels)
+
+
+    def blit(self, source, x, y, mode="over"):
+        """draws the source image onto this one with the source's
+        top-left corner at (x, y) (which may be outside this image);
+        whatever falls outside this image is clipped
+
+        mode "over" composites the source over this image using the
+        source's (straight, i.e., not premultiplied) alpha (Porter-Duff
+        over); "copy" replaces this image's pixels with the source's.
+        With numpy this is done with whole-array operations, otherwise a
+        row at a time; cyImage's blit() uses a compiled loop."""
+        if mode not in {"over", "copy"}:
+            raise Error("invalid blit mode '{}'; use over or copy".format(
+                    mode))
+        x0, y0 = max(0, x), max(0, y)
+        x1 = min(self.width, x + source.width)
+        y1 = min(self.height, y + source.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if numpy is not None:
+            pixels = source.as_array()[y0 - y:y1 - y, x0 - x:x1 - x]
+            target = self.as_array()[y0:y1, x0:x1]
+            target[:] = pixels if mode == "copy" else _over(pixels, target)
+            return
+        if source is self: # Don't overwrite rows before they are read
+            source = self.crop(0, 0, self.width, self.height)
+        for row in range(y0, y1):
+            start = (row * self.width) + x0
+            end = start + x1 - x0
+            offset = ((row - y) * source.width) + x0 - x
+            pixels = source.pixels[offset:offset + x1 - x0]
+            if mode == "over":
+                pixels = _over(pixels, self.pixels[start:end])
+            self.pixels[start:end] = pixels
+
+
+    def subsample(self, stride, workers=1):
         """returns a subsampled copy of this image.
         
         stride should be at least 2 but not too big; a stride of 2
@@ -300,9 +537,31 @@ class Image:
 
         Subsampling is fairly fast and produces good results for
         photographs: but poor results for text for which scale() is best.
+
+        With numpy, workers > 1 copies bands of rows in that many threads
+        (workers=None means one per core); the result is the same.
+        The implementation used is given by backend("subsample").
         """
         assert (2 <= stride <= min(self.width // 2, self.height // 2) and
                 isinstance(stride, int))
+        return _call("subsample", self, stride, workers)
+
+
+    def _subsample_numpy(self, stride, workers):
+        width = self.width // stride
+        height = self.height // stride
+        pixels = self.as_array()[:height * stride:stride,
+                                 :width * stride:stride]
+        if _worker_count(workers) == 1:
+            return self.from_data(width, pixels.ravel())
+        newPixels = numpy.empty((height, width), dtype=numpy.uint32)
+        def subsample_band(band):
+            newPixels[band] = pixels[band]
+        _map_bands(subsample_band, height, workers)
+        return self.from_data(width, newPixels.ravel())
+
+
+    def _subsample_python(self, stride, workers):
         pixels = create_array(self.width // stride, self.height // stride)
         index = 0
         height = self.height - (self.height % stride)
@@ -317,17 +576,40 @@ class Image:
         return self.from_data(self.width // stride, pixels)
 
 
-    def scale(self, ratio):
+    def scale(self, ratio, workers=1):
         """returns a smoothly scaled copy of this image
 
         ratio is how much to scale by, e.g., 0.75 means reduce width and
         height to ¾ their original size, 0.5 to half (making the image ¼
         of the original size), and so on.
 
+        Each new pixel's alpha is the mean of the alphas it covers and
+        its color their alpha-weighted (i.e., premultiplied) mean, so
+        transparent pixels don't darken or tint the edges of opaque
+        ones.
+
         Scaling is slow but produces good results even for text;
-        subsample() is faster.
+        subsample() is faster. To enlarge, change the aspect ratio, or
+        use a bilinear, bicubic, or Lanczos filter, use resample().
+
+        With numpy or Cython, workers > 1 scales bands of rows in that
+        many threads (workers=None means one per core) with the GIL
+        released, so the bands really are scaled in parallel, and the
+        result is exactly the same as for one worker. The implementation
+        used is given by backend("scale"); they all give the same result.
         """
         assert 0 < ratio < 1
+        return _call("scale", self, ratio, workers)
+
+
+    def _scale_cython(self, ratio, workers):
+        columns, pixels = _cython_scale(numpy.asarray(self.pixels,
+                dtype=numpy.uint32), self.width, self.height, ratio,
+                _worker_count(workers))
+        return self.from_data(columns, numpy.asarray(pixels))
+
+
+    def _scale_python(self, ratio, workers):
         rows = round(self.height * ratio)
         columns = round(self.width * ratio)
         pixels = create_array(columns, rows)
@@ -345,7 +627,33 @@ class Image:
         return self.from_data(columns, pixels)
 
 
+    def _scale_numpy(self, ratio, workers):
+        rows = round(self.height * ratio)
+        columns = round(self.width * ratio)
+        y0, y1 = _box_bounds(rows, self.height / rows, self.height)
+        x0, x1 = _box_bounds(columns, self.width / columns, self.width)
+        pixels = self.as_array()
+        if _worker_count(workers) == 1:
+            return self.from_data(columns, _box_means(pixels, y0, y1, x0,
+                    x1).ravel())
+        newPixels = numpy.empty((rows, columns), dtype=numpy.uint32)
+        def scale_band(band):
+            # Each band only needs the source rows its boxes cover; the
+            # boxes' totals are exact so the means are the same whatever
+            # the banding
+            top = y0[band.start]
+            bottom = y1[band.stop - 1]
+            newPixels[band] = _box_means(pixels[top:bottom],
+                    y0[band] - top, y1[band] - top, x0, x1)
+        _map_bands(scale_band, rows, workers)
+        return self.from_data(columns, newPixels.ravel())
+
+
     def _mean(self, x0, y0, x1, y1):
+        if numpy is not None:
+            planes = _planes(self.as_array()[y0:y1, x0:x1], True)
+            return _weighted_mean(*(int(plane.sum(dtype=numpy.int64))
+                    for plane in planes), count=planes[0].size)
         αTotal, redTotal, greenTotal, blueTotal, count = 0, 0, 0, 0, 0
         for y in range(y0, y1):
             if y >= self.height:
@@ -354,17 +662,101 @@ class Image:
             for x in range(x0, x1):
                 if x >= self.width:
                     break
-                α, r, g, b = self.argb_for_color(self.pixels[offset + x])
+                color = self.pixels[offset + x]
+                α = color >> 24
                 αTotal += α
-                redTotal += r
-                greenTotal += g
-                blueTotal += b
+                redTotal += ((color >> 16) & MAX_COMPONENT) * α
+                greenTotal += ((color >> 8) & MAX_COMPONENT) * α
+                blueTotal += (color & MAX_COMPONENT) * α
                 count += 1
-        α = round(αTotal / count)
-        r = round(redTotal / count)
-        g = round(greenTotal / count)
-        b = round(blueTotal / count)
-        return self.color_for_argb(α, r, g, b)
+        return _weighted_mean(αTotal, redTotal, greenTotal, blueTotal,
+                count)
+
+
+    def resample(self, width, height, filter="bicubic", workers=1):
+        """returns a copy of this image resampled to width x height
+
+        Unlike scale() this can enlarge as well as reduce and can change
+        the aspect ratio. filter is one of FILTERS: "bilinear",
+        "bicubic", or "lanczos" (sharpest, but slowest). Transparent
+        edges don't darken because colors are premultiplied by alpha
+        while being filtered.
+
+        The filter weights are computed once per size and filter and
+        cached, so resampling a batch of same-sized images only pays for
+        the filtering; a Resampler can be used to keep them explicitly.
+        With numpy or Cython, workers > 1 filters bands of rows in that
+        many threads (workers=None means one per core). The
+        implementation used is given by backend("resample").
+        """
+        return _resampler(self.width, self.height, width, height,
+                filter).resample(self, workers)
+
+
+    def _resample_cython(self, resampler, workers):
+        pixels = _cython_resample(numpy.asarray(self.pixels,
+                dtype=numpy.uint32), self.width, self.height,
+                resampler.xIndices, resampler.xWeights, resampler.yIndices,
+                resampler.yWeights, _worker_count(workers))
+        return self.from_data(resampler.newWidth, numpy.asarray(pixels))
+
+
+    def _resample_numpy(self, resampler, workers):
+        # Separable: filter each source row into newWidth columns, then
+        # each column of those into newHeight rows. The taps are summed
+        # in the same order as the other backends so results are equal.
+        planes = _premultiplied(self.as_array())
+        rows = numpy.empty((self.height, resampler.newWidth, 4))
+        newPlanes = numpy.empty((resampler.newHeight, resampler.newWidth,
+                4))
+        def filter_rows(band):
+            rows[band] = _weighted_sums(planes[band].transpose(1, 0, 2),
+                    resampler.xIndices, resampler.xWeights).transpose(1, 0,
+                    2)
+        def filter_columns(band):
+            newPlanes[band] = _weighted_sums(rows,
+                    resampler.yIndices[band], resampler.yWeights[band])
+        if _worker_count(workers) == 1:
+            filter_rows(slice(None))
+            filter_columns(slice(None))
+        else:
+            _map_bands(filter_rows, self.height, workers)
+            _map_bands(filter_columns, resampler.newHeight, workers)
+        return self.from_data(resampler.newWidth,
+                _straight_colors(newPlanes).ravel())
+
+
+    def _resample_python(self, resampler, workers):
+        rows = []
+        for y in range(self.height):
+            offset = y * self.width
+            source = [_premultiplied_argb(self.pixels[offset + x])
+                      for x in range(self.width)]
+            row = []
+            for indices, weights in resampler.columns:
+                α, r, g, b = 0.0, 0.0, 0.0, 0.0
+                for x, weight in zip(indices, weights):
+                    sα, sr, sg, sb = source[x]
+                    α += weight * sα
+                    r += weight * sr
+                    g += weight * sg
+                    b += weight * sb
+                row.append((α, r, g, b))
+            rows.append(row)
+        pixels = create_array(resampler.newWidth, resampler.newHeight)
+        index = 0
+        for indices, weights in resampler.rows:
+            for column in range(resampler.newWidth):
+                α, r, g, b = 0.0, 0.0, 0.0, 0.0
+                for y, weight in zip(indices, weights):
+                    sα, sr, sg, sb = rows[y][column]
+                    α += weight * sα
+                    r += weight * sr
+                    g += weight * sg
+                    b += weight * sb
+                pixels[index] = _straight_color(α, r, g, b)
+                index += 1
+        return self.from_data(resampler.newWidth, pixels)
 
 
     def __str__(self):
@@ -382,6 +774,103 @@ class Image:
         return self.width, self.height
 
 
+    def as_array(self, channels=False):
+        """returns a numpy view of the pixels (no data is copied so
+        changes to the view change the image)
+
+        If channels is False the view is a (height, width) array of ARGB
+        uint32s; otherwise it is a (height, width, 4) array of uint8s in
+        A, R, G, B order whatever the machine's byte order. Requires
+        numpy."""
+        if numpy is None:
+            raise Error("as_array() requires numpy")
+        pixels = numpy.asarray(self.pixels, dtype=numpy.uint32).reshape(
+                self.height, self.width)
+        if not channels:
+            return pixels
+        components = pixels.view(numpy.uint8).reshape(self.height,
+                self.width, 4)
+        return components[..., ::-1] if sys.byteorder == "little" else (
+                components)
+
+
+    def as_planes(self, premultiplied=False):
+        """returns a new (4, height, width) numpy uint16 array of the
+        pixels' A, R, G, and B components, one plane per component
+
+        If premultiplied is True the R, G, and B planes are multiplied
+        by the A plane without being divided by 255, so they are exact
+        (0 to 65025) and from_planes() restores the image losslessly.
+        Sums, means, and blends of premultiplied planes can be done with
+        whole-array integer arithmetic and the result only packed back
+        into ARGB pixels when needed. Requires numpy."""
+        if numpy is None:
+            raise Error("as_planes() requires numpy")
+        return _planes(self.as_array(), premultiplied)
+
+
+    @classmethod
+    def from_planes(Class, planes, premultiplied=False):
+        """returns an Image whose pixels are packed from the
+        (4, height, width) A, R, G, B planes (as returned by
+        as_planes()); values out of range are clamped. Requires
+        numpy."""
+        if numpy is None:
+            raise Error("from_planes() requires numpy")
+        planes = numpy.asarray(planes)
+        α = numpy.minimum(planes[0], MAX_COMPONENT).astype(numpy.uint32)
+        pixels = α << 24
+        divisor = numpy.maximum(α, 1)
+        for plane, shift in zip(planes[1:], (16, 8, 0)):
+            component = plane.astype(numpy.uint32)
+            if premultiplied: # Round to nearest
+                component = (component + (divisor // 2)) // divisor
+            pixels |= numpy.minimum(component, MAX_COMPONENT) << shift
+        return Class.from_data(planes.shape[2], pixels.ravel())
+
+
+    def share(self):
+        """returns a SharedBuffer that describes a new shared memory block
+        holding a copy of the image's pixels (but not its meta data)
+
+        Only the small SharedBuffer need be passed to another process,
+        which can use from_shared() to get the image. The block exists
+        until release_shared() is called (by any one process), which
+        from_shared() does by default. (On Windows the image itself is
+        returned instead and from_shared() just returns it.)"""
+        if not _SHARE_MEMORY:
+            return self
+        pixels = (numpy.ascontiguousarray(self.pixels, dtype=numpy.uint32)
+                  if numpy is not None else self.pixels)
+        return _share(memoryview(pixels).cast("B"), self.width,
+                self.height, "uint32")
+
+
+    @classmethod
+    def from_shared(Class, shared, release=True):
+        """returns an Image whose pixels are copied from the shared memory
+        block described by shared (as returned by share()); unless
+        release is False the block is then released"""
+        if not isinstance(shared, SharedBuffer):
+            return shared
+        with shared_view(shared, release) as view:
+            if numpy is not None:
+                pixels = numpy.frombuffer(view, dtype=numpy.uint32).copy()
+            else:
+                pixels = create_array(0, 0)
+                pixels.frombytes(view)
+        if not shared.width: # from_data() needs a width
+            return Class.create(0, shared.height)
+        return Class.from_data(shared.width, pixels)
+
+
+    def __buffer__(self, flags):
+        # Python 3.12+ buffer protocol (PEP 688), so memoryview(image),
+        # mmap.write(image), etc., work without copying; on older
+        # Pythons use memoryview(image.pixels) instead
+        return memoryview(self.pixels)
+
+
     @staticmethod
     def argb_for_color(color):
         """returns an ARGB quadruple for a color specified as an int or
@@ -436,24 +925,11 @@ class Image:
         """returns an ARGB int for a color specified as an int or
         a color name or an #HHH, #HHHH, #HHHHHH or #HHHHHHHH RGB
         str---in the latter case the alpha channel is set to 0xFF
-        (solid) if not specified"""
+        (solid) if not specified; X11's #HHHHHHHHH and #HHHHHHHHHHHH
+        are accepted too. Results are cached."""
         if name is None:
             return ColorForName["transparent"]  
-        if name.startswith("#"):
-            name = name[1:]
-            if len(name) == 3: # add solid alpha
-                name = "F" + name # now has 4 hex digits
-            if len(name) == 6: # add solid alpha
-                name = "FF" + name # now has the full 8 hex digits
-            if len(name) == 4: # originally #FFF or #FFFF
-                components = []
-                for h in name:
-                    components.extend([h, h])
-                name = "".join(components) # now has the full 8 hex digits
-            return int(name, 16)
-        return ColorForName[name.lower()]
-        # ColorForName is a default dict so will always return a color,
-        # e.g., black
+        return _color_for_name(name)
 
 
     def _dump(self, file=sys.stdout, alpha=True):
@@ -475,6 +951,416 @@ rgb_for_color = Image.rgb_for_color
 color_for_argb = Image.color_for_argb
 color_for_rgb = Image.color_for_rgb
 color_for_name = Image.color_for_name
+from_file = Image.from_file
+from_bytes = Image.from_bytes
+create = Image.create
+from_data = Image.from_data
+
+
+class Resampler:
+    """Resamples width x height images to newWidth x newHeight
+
+    The weights that each result column and row gives to the source
+    columns and rows are computed once, here, so one Resampler can
+    resample a whole batch of same-sized images. filter is one of
+    FILTERS: "bilinear" (triangle), "bicubic" (Keys, a = -0.5), or
+    "lanczos" (3 lobes). When reducing, the filter is widened in
+    proportion so that every source pixel contributes.
+    """
+
+    def __init__(self, width, height, newWidth, newHeight,
+            filter="bicubic"):
+        if filter not in _Filters:
+            raise Error("invalid filter '{}'; use one of: {}".format(
+                    filter, ", ".join(FILTERS)))
+        assert min(width, height, newWidth, newHeight) > 0
+        self.width = width
+        self.height = height
+        self.newWidth = newWidth
+        self.newHeight = newHeight
+        self.filter = filter
+        kernel, radius = _Filters[filter]
+        self.columns = _filter_taps(width, newWidth, kernel, radius)
+        self.rows = _filter_taps(height, newHeight, kernel, radius)
+        if numpy is not None:
+            self.xIndices, self.xWeights = _tap_arrays(self.columns)
+            self.yIndices, self.yWeights = _tap_arrays(self.rows)
+
+
+    def resample(self, image, workers=1):
+        """returns a newWidth x newHeight resampled copy of the image,
+        which must be width x height; see Image.resample()"""
+        if image.size != (self.width, self.height):
+            raise Error("a {}x{} Resampler can't resample {}".format(
+                    self.width, self.height, image))
+        return _call("resample", image, self, workers)
+
+
+@functools.lru_cache(maxsize=16)
+def _resampler(width, height, newWidth, newHeight, filter):
+    return Resampler(width, height, newWidth, newHeight, filter)
+
+
+def _modules_for(suffix):
+    # Returns the modules that might handle files with the suffix,
+    # importing any that haven't been imported yet
+    global _Unregistered
+    if _Unregistered is None:
+        registered = set(_Registry.values())
+        _Unregistered = [name for name in (os.path.splitext(name)[0]
+                for name in sorted(os.listdir(os.path.dirname(__file__)))
+                if not name.startswith("_") and name.endswith(".py"))
+                if name not in registered]
+    names = _Unregistered
+    if suffix in _Registry:
+        names = [_Registry[suffix]] + names
+    modules = []
+    for name in names:
+        if name not in _Modules:
+            try:
+                _Modules[name] = importlib.import_module("." + name,
+                        "Image")
+            except ImportError as err:
+                _Modules[name] = None
+                warnings.warn("failed to load Image module: {}".format(
+                        err))
+        if _Modules[name] is not None:
+            modules.append(_Modules[name])
+    return modules
+
+
+def probe(filename):
+    """returns the (width, height) of the image in the file called
+    filename reading as little of the file as its format allows"""
+    module = Image._choose_module("can_load", filename)
+    if module is None:
+        raise Error("no Image module can load files of type {}".format(
+                os.path.splitext(filename)[1]))
+    probe = getattr(module, "probe", None)
+    if probe is not None:
+        return probe(filename)
+    return Image.from_file(filename).size
+
+
+class ProbeCache:
+
+    def __init__(self, filename):
+        """An on-disk cache of probe() results
+
+        Entries are keyed by the image file's absolute path and are only
+        used if the file's modification time and size are unchanged.
+        Call save() to write any new entries to the cache file."""
+        self.filename = filename
+        self.sizes = {}
+        self.changed = False
+        try:
+            with open(filename, "rt", encoding="utf-8") as file:
+                self.sizes = json.load(file)
+        except (OSError, ValueError):
+            pass # A missing or corrupt cache is just rebuilt
+
+
+    def probe(self, filename):
+        """returns the (width, height) of the image in the file called
+        filename from the cache if possible, otherwise using probe()"""
+        stat = os.stat(filename)
+        key = os.path.abspath(filename)
+        validator = [stat.st_mtime_ns, stat.st_size]
+        entry = self.sizes.get(key)
+        if entry is not None and entry[:2] == validator:
+            return tuple(entry[2:])
+        width, height = probe(filename)
+        self.sizes[key] = validator + [width, height]
+        self.changed = True
+        return width, height
+
+
+    def save(self):
+        if self.changed:
+            temporary = self.filename + ".tmp"
+            with open(temporary, "wt", encoding="utf-8") as file:
+                json.dump(self.sizes, file)
+            os.replace(temporary, self.filename)
+            self.changed = False
+
+
+def share_bytes(data):
+    """returns a SharedBuffer that describes a new shared memory block
+    holding a copy of data (bytes or any other buffer), so that only the
+    small SharedBuffer need be passed to another process, which can use
+    shared_view() or bytes_from_shared() to get at the data
+
+    The block exists until release_shared() is called (by any one
+    process), which shared_view() and bytes_from_shared() do by default.
+    (On Windows the data is returned as bytes instead and the other
+    functions accept that.)"""
+    if not _SHARE_MEMORY:
+        return bytes(data)
+    data = memoryview(data).cast("B")
+    return _share(data, len(data), 1, "uint8")
+
+
+def share_file(filename):
+    """returns a SharedBuffer like share_bytes() but for a new shared
+    memory block that the contents of the file called filename are read
+    straight into"""
+    with open(filename, "rb") as file:
+        if not _SHARE_MEMORY:
+            return file.read()
+        size = os.fstat(file.fileno()).st_size
+        block = _shared_memory(size)
+        try:
+            count = 0
+            with block.buf[:size] as view:
+                while count < size:
+                    read = file.readinto(view[count:])
+                    if not read: # The file has shrunk
+                        break
+                    count += read
+        except BaseException:
+            block.unlink()
+            raise
+        finally:
+            block.close() # The block lives on until it is unlinked
+    return SharedBuffer(block.name, count, 1, "uint8")
+
+
+@contextlib.contextmanager
+def shared_view(shared, release=True):
+    """yields a memoryview of the data in the shared memory block
+    described by shared (as returned by share_bytes(), share_file(), or
+    Image.share()) without copying it; unless release is False the block
+    is released afterwards
+
+    Neither the view nor anything that refers to its memory (e.g., a
+    numpy.frombuffer() array) may be kept beyond the with statement."""
+    if not isinstance(shared, SharedBuffer):
+        with memoryview(shared) as view: # The payload itself (Windows)
+            yield view
+        return
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=shared.name)
+    try:
+        size = shared.width * shared.height * _ITEMSIZE[shared.dtype]
+        with block.buf[:size] as view:
+            yield view
+    finally:
+        if release:
+            block.unlink()
+        block.close()
+
+
+def bytes_from_shared(shared, release=True):
+    """returns a copy of the data in the shared memory block described by
+    shared (as returned by share_bytes() or share_file()); unless release
+    is False the block is then released"""
+    if not isinstance(shared, SharedBuffer):
+        return shared
+    with shared_view(shared, release) as view:
+        return bytes(view)
+
+
+def release_shared(shared):
+    """destroys the shared memory block described by shared (as returned
+    by share_bytes(), share_file(), or Image.share()) if it still exists;
+    every block must be released exactly once, e.g., if the job that
+    would have read it is canceled"""
+    if isinstance(shared, SharedBuffer):
+        from multiprocessing import shared_memory
+        try:
+            block = shared_memory.SharedMemory(name=shared.name)
+        except FileNotFoundError:
+            return # Already released
+        block.unlink()
+        block.close()
+
+
+def _shared_memory(size):
+    from multiprocessing import shared_memory # Imported here as it's
+    return shared_memory.SharedMemory(create=True, # rarely needed
+            size=max(1, size))
+
+
+def _share(data, width, height, dtype):
+    block = _shared_memory(len(data))
+    try:
+        block.buf[:len(data)] = data
+    except BaseException:
+        block.unlink()
+        raise
+    finally:
+        block.close() # The block lives on until it is unlinked
+    return SharedBuffer(block.name, width, height, dtype)
+
+
+def scale_file(sourceFilename, targetFilename, ratio):
+    """scales the image in the file called sourceFilename and saves it
+    as targetFilename; the result is the same as
+    from_file(sourceFilename).scale(ratio).save(targetFilename)
+
+    If the formats' modules provide read_rows() and write_rows() the
+    source is read, and the target written, a row at a time, so only a
+    stripe of the source as deep as one scaled row is ever held in
+    memory; this allows images far larger than memory to be scaled."""
+    assert 0 < ratio < 1
+    width, height, rows = _read_rows(sourceFilename)
+    newHeight = round(height * ratio)
+    newWidth = round(width * ratio)
+    _write_rows(targetFilename, newWidth, newHeight,
+            _scaled_rows(width, height, rows, newWidth, newHeight))
+
+
+def subsample_file(sourceFilename, targetFilename, stride):
+    """subsamples the image in the file called sourceFilename and saves
+    it as targetFilename a row at a time (if the formats' modules allow);
+    the result is the same as
+    from_file(sourceFilename).subsample(stride).save(targetFilename)"""
+    width, height, rows = _read_rows(sourceFilename)
+    assert (2 <= stride <= min(width // 2, height // 2) and
+            isinstance(stride, int))
+    newWidth = width // stride
+    newHeight = height // stride
+    rows = itertools.islice(rows, 0, newHeight * stride, stride)
+    _write_rows(targetFilename, newWidth, newHeight,
+            (row[:newWidth * stride:stride] for row in rows))
+
+
+def _read_rows(filename):
+    # Returns the width, height, and an iterator of rows of the image in
+    # the file, reading the rows lazily if the module supports it
+    module = Image._choose_module("can_load", filename)
+    if module is None:
+        raise Error("no Image module can load files of type {}".format(
+                os.path.splitext(filename)[1]))
+    read_rows = getattr(module, "read_rows", None)
+    if read_rows is not None:
+        return read_rows(filename)
+    image = Image.from_file(filename)
+    offsets = (y * image.width for y in range(image.height))
+    return image.width, image.height, (
+            image.pixels[offset:offset + image.width] for offset in offsets)
+
+
+def _write_rows(filename, width, height, rows):
+    # Writes the rows to the file as they are produced if the module
+    # supports it, otherwise assembles them into an image and saves that
+    module = Image._choose_module("can_save", filename)
+    if module is None:
+        raise Error("no Image module can save files of type {}".format(
+                os.path.splitext(filename)[1]))
+    write_rows = getattr(module, "write_rows", None)
+    if write_rows is not None:
+        write_rows(filename, width, height, rows)
+    else:
+        image = Image.create(width, height)
+        for y, row in enumerate(rows):
+            image.pixels[y * width:(y + 1) * width] = row
+        image.save(filename)
+
+
+def _scaled_rows(width, height, rows, newWidth, newHeight):
+    # Yields each of the newHeight scaled rows keeping only the source
+    # rows that the current scaled row (and perhaps the next) covers
+    yStep = height / newHeight
+    if numpy is not None:
+        x0, x1 = _box_bounds(newWidth, width / newWidth, width)
+    else:
+        xStep = width / newWidth
+        x0 = [round(column * xStep) for column in range(newWidth)]
+        x1 = [round(x + xStep) for x in x0]
+    stripe = collections.deque()
+    rows = iter(rows)
+    y = 0 # The index of the next source row
+    for row in range(newHeight):
+        y0 = round(row * yStep)
+        y1 = min(round(y0 + yStep), height)
+        while stripe and stripe[0][0] < y0:
+            stripe.popleft()
+        while y < y1:
+            pixels = next(rows)
+            if y >= y0:
+                stripe.append((y, pixels))
+            y += 1
+        if numpy is not None:
+            pixels = numpy.vstack([pixels for _, pixels in stripe])
+            yield _box_means(pixels, numpy.array([0]),
+                    numpy.array([len(stripe)]), x0, x1)[0]
+        else:
+            image = Image.create(width, len(stripe))
+            for i, (_, pixels) in enumerate(stripe):
+                image.pixels[i * width:(i + 1) * width] = pixels
+            newPixels = create_array(newWidth, 1)
+            for column in range(newWidth):
+                newPixels[column] = image._mean(x0[column], 0,
+                        x1[column], len(stripe))
+            yield newPixels
+
+
+BACKEND_ENVIRONMENT = "IMAGE_BACKEND"
+BACKENDS = ("cython", "numpy", "python") # In order of preference
+
+# Keyed by operation, then backend; unavailable backends are None
+_Implementations = {
+    "scale": {"cython": Image._scale_cython if _cython_scale else None,
+              "numpy": Image._scale_numpy if numpy else None,
+              "python": Image._scale_python},
+    "subsample": {"numpy": Image._subsample_numpy if numpy else None,
+                  "python": Image._subsample_python},
+    "resample": {"cython": Image._resample_cython if _cython_resample
+                           else None,
+                 "numpy": Image._resample_numpy if numpy else None,
+                 "python": Image._resample_python}}
+BackendCalls = collections.Counter() # Keyed by (operation, backend)
+
+
+def backend(operation):
+    """returns the name of the backend ("cython", "numpy", or "python")
+    that performs the given operation ("scale", "subsample", or
+    "resample")
+
+    The fastest available backend is used unless the IMAGE_BACKEND
+    environment variable names another, either for every operation
+    (e.g., IMAGE_BACKEND=python) or per operation (e.g.,
+    IMAGE_BACKEND=scale=numpy,subsample=python). BackendCalls counts
+    the calls each backend has served."""
+    return _Backends[operation]
+
+
+def _choose_backends(setting):
+    # Returns the backend to use for each operation given the setting
+    # of the IMAGE_BACKEND environment variable; a backend that is set
+    # for every operation is only used by those that have it
+    wanted = {}
+    for part in filter(None, (part.strip() for part in setting.split(","))):
+        operation, _, name = part.rpartition("=")
+        if operation:
+            wanted[operation] = name
+        else:
+            for operation, implementations in _Implementations.items():
+                if name in implementations or name not in BACKENDS:
+                    wanted[operation] = name
+    chosen = {}
+    for operation, implementations in _Implementations.items():
+        name = wanted.pop(operation, None)
+        if name is not None and implementations.get(name) is None:
+            warnings.warn("{} backend for {}() is not available; using "
+                    "the default".format(name, operation))
+            name = None
+        chosen[operation] = name or next(name for name in BACKENDS
+                if implementations.get(name) is not None)
+    for operation in wanted:
+        warnings.warn("no Image operation called {} for {}".format(
+                operation, BACKEND_ENVIRONMENT))
+    return chosen
+
+
+_Backends = _choose_backends(os.environ.get(BACKEND_ENVIRONMENT, ""))
+
+
+def _call(operation, image, *args):
+    name = _Backends[operation]
+    BackendCalls[operation, name] += 1
+    return _Implementations[operation][name](image, *args)
 
 
 def sanitized_name(name):
@@ -485,6 +1371,239 @@ def sanitized_name(name):
     return name
 
 
+def _box_bounds(count, step, limit):
+    """returns numpy arrays of the start and end offsets of count boxes
+    of the given step, rounded as scale() does and clipped to limit"""
+    starts = [round(i * step) for i in range(count)]
+    ends = [min(round(start + step), limit) for start in starts]
+    return (numpy.array(starts, dtype=numpy.intp),
+            numpy.array(ends, dtype=numpy.intp))
+
+
+def _box_means(pixels, y0, y1, x0, x1):
+    """returns a (len(y0), len(x0)) numpy array of the mean colors of
+    the boxes of the 2D pixels array given by the bounds arrays"""
+    # Each premultiplied plane is box-summed using summed-area tables: a
+    # cumulative sum down the columns gives every row band's totals in
+    # one subtraction, and a cumulative sum along that gives every box's
+    # totals. The box bounds and the round-half-to-even are exactly
+    # those of the pure Python loop in _scale_python().
+    height, width = pixels.shape
+    counts = numpy.outer(y1 - y0, x1 - x0)
+    totals = []
+    for plane in _planes(pixels, True):
+        table = numpy.zeros((height + 1, width), dtype=numpy.int64)
+        numpy.cumsum(plane, axis=0, out=table[1:])
+        band = table[y1] - table[y0]
+        table = numpy.zeros((len(y0), width + 1), dtype=numpy.int64)
+        numpy.cumsum(band, axis=1, out=table[:, 1:])
+        totals.append(table[:, x1] - table[:, x0])
+    αTotals = totals[0]
+    means = numpy.rint(αTotals / counts).astype(numpy.uint32) << 24
+    for total, shift in zip(totals[1:], (16, 8, 0)):
+        mean = numpy.divide(total, αTotals, out=numpy.zeros(total.shape),
+                where=αTotals > 0)
+        means |= numpy.rint(mean).astype(numpy.uint32) << shift
+    means[αTotals == 0] = 0
+    return means
+
+
+def _planes(pixels, premultiplied):
+    """returns a (4,) + pixels.shape uint16 array of the pixels' A, R,
+    G, B planes, with R, G, and B × A if premultiplied"""
+    planes = numpy.empty((4,) + pixels.shape, dtype=numpy.uint16)
+    for plane, shift in zip(planes, (24, 16, 8, 0)):
+        plane[...] = (pixels >> shift) & MAX_COMPONENT
+    if premultiplied:
+        planes[1:] *= planes[0] # At most 255 × 255 so can't overflow
+    return planes
+
+
+def _weighted_mean(αTotal, redTotal, greenTotal, blueTotal, count):
+    """returns the color whose alpha is the mean of the count alphas and
+    whose color is the mean of the colors weighted by their alphas; the
+    color totals are of the premultiplied (component × alpha) colors"""
+    if not αTotal:
+        return 0 # All transparent
+    return color_for_argb(round(αTotal / count), round(redTotal / αTotal),
+            round(greenTotal / αTotal), round(blueTotal / αTotal))
+
+
+def _triangle(x):
+    x = abs(x)
+    return 1.0 - x if x < 1 else 0.0
+
+
+def _cubic(x):
+    # Keys' cubic convolution with a = -0.5 (Catmull-Rom)
+    x = abs(x)
+    if x < 1:
+        return (1.5 * x - 2.5) * x * x + 1
+    if x < 2:
+        return ((-0.5 * x + 2.5) * x - 4) * x + 2
+    return 0.0
+
+
+def _lanczos(x):
+    if x == 0:
+        return 1.0
+    if -3 < x < 3:
+        πx = math.pi * x
+        return 3 * math.sin(πx) * math.sin(πx / 3) / (πx * πx)
+    return 0.0
+
+
+_Filters = {"bilinear": (_triangle, 1), "bicubic": (_cubic, 2),
+            "lanczos": (_lanczos, 3)} # Each kernel and its radius
+FILTERS = tuple(_Filters)
+
+
+def _filter_taps(size, newSize, kernel, radius):
+    """returns a list of (indices, weights) pairs, one per new column
+    (or row), giving the source columns (rows) that contribute to it
+    and their normalized weights"""
+    ratio = newSize / size
+    stretch = max(1.0, 1 / ratio) # Widen the kernel when reducing
+    support = radius * stretch
+    taps = []
+    for i in range(newSize):
+        centre = (i + 0.5) / ratio
+        first = max(0, int(centre - support + 0.5))
+        last = min(size, int(centre + support + 0.5))
+        weights = [kernel((j + 0.5 - centre) / stretch)
+                   for j in range(first, last)]
+        total = sum(weights)
+        taps.append((range(first, last), [weight / total
+                                          for weight in weights]))
+    return taps
+
+
+def _tap_arrays(taps):
+    """returns (len(taps), most taps) numpy arrays of the indices and
+    weights; shorter rows are padded with zero weights"""
+    count = max(len(indices) for indices, _ in taps)
+    indices = numpy.empty((len(taps), count), dtype=numpy.intp)
+    weights = numpy.zeros((len(taps), count))
+    for i, (tapIndices, tapWeights) in enumerate(taps):
+        indices[i] = tapIndices[-1]
+        indices[i, :len(tapIndices)] = tapIndices
+        weights[i, :len(tapWeights)] = tapWeights
+    return indices, weights
+
+
+def _weighted_sums(planes, indices, weights):
+    """returns a (len(indices), ...) array whose every row is the sum of
+    the planes' rows given by the corresponding indices row, each
+    multiplied by its weight"""
+    sums = numpy.zeros((len(indices),) + planes.shape[1:])
+    for tap in range(indices.shape[1]):
+        sums += weights[:, tap, None, None] * planes[indices[:, tap]]
+    return sums
+
+
+def _premultiplied(pixels):
+    """returns a (height, width, 4) float array of the A, R, G, B
+    components of the 2D pixels with R, G, and B multiplied by alpha"""
+    α = (pixels >> 24) & MAX_COMPONENT
+    planes = numpy.empty(pixels.shape + (4,))
+    planes[..., 0] = α
+    for i, shift in enumerate((16, 8, 0), 1):
+        planes[..., i] = ((pixels >> shift) & MAX_COMPONENT) * α / (
+                MAX_COMPONENT)
+    return planes
+
+
+def _straight_colors(planes):
+    """returns the 2D uint32 pixels for the (height, width, 4)
+    premultiplied planes, clamped to the valid range"""
+    α = numpy.clip(planes[..., 0], 0.0, MAX_COMPONENT)
+    colors = numpy.minimum(numpy.maximum(planes[..., 1:], 0.0),
+            α[..., None])
+    colors = numpy.divide(colors * MAX_COMPONENT, α[..., None],
+            out=numpy.zeros_like(colors), where=α[..., None] > 0)
+    pixels = numpy.rint(α).astype(numpy.uint32) << 24
+    for i, shift in enumerate((16, 8, 0)):
+        pixels |= numpy.rint(colors[..., i]).astype(numpy.uint32) << shift
+    return pixels
+
+
+def _premultiplied_argb(color):
+    α, r, g, b = argb_for_color(color)
+    return (α, r * α / MAX_COMPONENT, g * α / MAX_COMPONENT,
+            b * α / MAX_COMPONENT)
+
+
+def _straight_color(α, r, g, b):
+    α = min(max(α, 0.0), MAX_COMPONENT)
+    if α > 0:
+        r, g, b = (round(min(max(component, 0.0), α) * MAX_COMPONENT / α)
+                   for component in (r, g, b))
+    else:
+        r = g = b = 0
+    return color_for_argb(round(α), r, g, b)
+
+
+def _over(colors, pixels):
+    """returns the pixels with the ARGB colors (one color, or one per
+    pixel) composited over them using the colors' (straight, i.e., not
+    premultiplied) alphas; fully transparent colors change nothing"""
+    if numpy is not None:
+        source = numpy.asarray(colors, dtype=numpy.int64)
+        target = numpy.asarray(pixels, dtype=numpy.int64)
+        α = (source >> 24) & MAX_COMPONENT
+        weight = ((target >> 24) & MAX_COMPONENT) * (MAX_COMPONENT - α)
+        total = (α * MAX_COMPONENT) + weight # The new alpha × 255
+        divisor = numpy.maximum(total, 1)
+        result = ((total + (MAX_COMPONENT // 2)) // MAX_COMPONENT) << 24
+        for shift in (16, 8, 0):
+            numerator = ((((source >> shift) & MAX_COMPONENT) * α *
+                    MAX_COMPONENT) + (((target >> shift) & MAX_COMPONENT) *
+                    weight))
+            result |= ((numerator + (divisor // 2)) // divisor) << shift
+        return numpy.where(α == 0, target, result).astype(numpy.uint32)
+    if isinstance(colors, int):
+        colors = itertools.repeat(colors)
+    blended = {} # Spans are often of just a few colors
+    result = array.array(pixels.typecode, pixels)
+    for i, key in enumerate(zip(colors, pixels)):
+        value = blended.get(key)
+        if value is None:
+            value = blended[key] = _over_color(*key)
+        result[i] = value
+    return result
+
+
+def _over_color(color, pixel):
+    α = color >> 24
+    if not α:
+        return pixel
+    weight = (pixel >> 24) * (MAX_COMPONENT - α)
+    total = (α * MAX_COMPONENT) + weight
+    value = ((total + (MAX_COMPONENT // 2)) // MAX_COMPONENT) << 24
+    for shift in (16, 8, 0):
+        numerator = ((((color >> shift) & MAX_COMPONENT) * α *
+                MAX_COMPONENT) + (((pixel >> shift) & MAX_COMPONENT) *
+                weight))
+        value |= ((numerator + (total // 2)) // total) << shift
+    return value
+
+
+def _worker_count(workers):
+    return (os.cpu_count() or 1) if workers is None else max(1, workers)
+
+
+def _map_bands(function, rows, workers):
+    # Calls function(band) for contiguous slices of range(rows), one per
+    # worker, in a pool of threads
+    import concurrent.futures # Imported here as it takes ~20ms (logging)
+    workers = min(_worker_count(workers), rows)
+    bounds = [rows * i // workers for i in range(workers + 1)]
+    bands = [slice(start, end) for start, end in zip(bounds, bounds[1:])]
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for _ in executor.map(function, bands):
+            pass # Propagate any exception
+
+
 def create_array(width, height, background=None):
     """returns an array.array or numpy.array of the correct size and
     with the given background color"""
@@ -502,6 +1621,31 @@ def create_array(width, height, background=None):
         return array.array(typecode, [background] * width * height)
 
 
+@functools.lru_cache(maxsize=4096)
+def _color_for_name(name):
+    # Cached by the raw string since XPM palettes and drawing code parse
+    # the same names and hex strings over and over
+    if name.startswith("#"):
+        name = name[1:]
+        if len(name) in {9, 12}: # X11 #RRRGGGBBB or #RRRRGGGGBBBB
+            size = len(name) // 3 # Keep each component's top 8 bits
+            name = "FF" + "".join(name[i:i + 2]
+                                  for i in range(0, len(name), size))
+        if len(name) == 3: # add solid alpha
+            name = "F" + name # now has 4 hex digits
+        if len(name) == 6: # add solid alpha
+            name = "FF" + name # now has the full 8 hex digits
+        if len(name) == 4: # originally #FFF or #FFFF
+            components = []
+            for h in name:
+                components.extend([h, h])
+            name = "".join(components) # now has the full 8 hex digits
+        return int(name, 16)
+    # Not ColorForName[name] since that would add unknown names to it
+    color = ColorForName.get(name.lower())
+    return color if color is not None else ColorForName.default_factory()
+
+
 # Taken from rgb.txt and converted to ARGB (with the addition of
 # transparent). Default is solid black.
 ColorForName = collections.defaultdict(lambda: 0xFF000000, {
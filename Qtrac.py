@@ -13,7 +13,10 @@ import abc
 import collections
 import errno
 import functools
+import hashlib
+import json
 import os
+import signal
 import sys
 
 
@@ -91,8 +94,163 @@ class Requirer(metaclass=abc.ABCMeta):
         return NotImplemented
 
 
+def ignore_interrupts():
+    """for use as a process pool's initializer: a Ctrl+C is sent to every
+    process in the terminal's process group, so this stops it killing
+    the pool's processes mid-job, leaving the parent to cancel the jobs
+    that haven't started and to account for those that have"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
 def report(message="", error=False):
     if len(message) >= 70 and not error:
         message = message[:67] + "..."
     sys.stdout.write("\r{:70}{}".format(message, "\n" if error else ""))   # write into ram
     sys.stdout.flush()  # output from ram and clean ram
+
+
+# What Manifest.record() records of a source: its [mtime_ns, size]
+# validator and the hex SHA-256 digest of its contents
+Fingerprint = collections.namedtuple("Fingerprint", "validator hash")
+
+
+class Manifest:
+
+    def __init__(self, filename, parameters):
+        """An on-disk record of which target files were made from which
+        source files, for skipping unchanged sources on the next run
+
+        Entries are keyed by the source's absolute path and hold its
+        modification time, size and SHA-256 content hash, the target's
+        absolute path, and the parameters (a JSON-compatible dict, e.g.,
+        of the scaling options) that were used to make the target. Call
+        save() to write any new entries to the manifest file."""
+        self.filename = filename
+        self.parameters = parameters
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(filename, "rt", encoding="utf-8") as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            pass # A missing or corrupt manifest is just rebuilt
+
+
+    def up_to_date(self, source, target):
+        """returns True if target exists and was made from source using
+        the same parameters, and source is unchanged since; source is
+        only read (to compare its hash) if its modification time has
+        changed but its size hasn't"""
+        entry = self.entries.get(os.path.abspath(source))
+        if (entry is None or entry["parameters"] != self.parameters or
+                entry["target"] != os.path.abspath(target) or
+                not os.path.exists(target)):
+            return False
+        try:
+            stat = os.stat(source)
+            validator = [stat.st_mtime_ns, stat.st_size]
+            if validator == entry["validator"]:
+                return True
+            if (validator[1] != entry["validator"][1] or
+                    file_hash(source) != entry["hash"]):
+                return False
+        except OSError:
+            return False
+        entry["validator"] = validator # Touched or copied but unchanged
+        self.changed = True
+        return True
+
+
+    def record(self, source, target, fingerprint):
+        """records that target has been made from source using the
+        parameters; fingerprint is the Fingerprint of the contents of
+        source that target was made from (see read_fingerprinted()), so
+        that if source has changed since then up_to_date() will notice"""
+        self.entries[os.path.abspath(source)] = dict(
+                validator=list(fingerprint.validator),
+                hash=fingerprint.hash, target=os.path.abspath(target),
+                parameters=self.parameters)
+        self.changed = True
+
+
+    def save(self):
+        if self.changed:
+            temporary = self.filename + ".tmp"
+            with open(temporary, "wt", encoding="utf-8") as file:
+                json.dump(self.entries, file)
+            os.replace(temporary, self.filename)
+            self.changed = False
+
+
+class ChunkSizer:
+
+    def __init__(self, seconds=0.1, largest=256):
+        """Chooses how many jobs to give each call to a worker so that
+        each call takes about seconds, judging by the observed time per
+        job
+
+        Grouping quick jobs this way spreads the cost of each round trip
+        to a worker process over many of them, while slow jobs still get
+        one call each. Use chunks() to group the jobs and observe() to
+        report how long each chunk took."""
+        self.seconds = seconds
+        self.largest = largest
+        self.perJob = None
+
+
+    @property
+    def size(self):
+        if self.perJob is None: # Nothing observed yet
+            return 1
+        if self.perJob == 0:
+            return self.largest
+        return max(1, min(self.largest, int(self.seconds / self.perJob)))
+
+
+    def observe(self, count, seconds):
+        """records that a chunk of count jobs took seconds of work"""
+        if count:
+            perJob = seconds / count
+            self.perJob = (perJob if self.perJob is None else
+                           (self.perJob + perJob) / 2)
+
+
+    def chunks(self, iterable):
+        """yields lists of the items in iterable, each as long as the
+        size was when it was started"""
+        chunk = []
+        size = self.size
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+                size = self.size
+        if chunk:
+            yield chunk
+
+
+def read_fingerprinted(filename):
+    """returns the contents of the file called filename and their
+    Fingerprint for Manifest.record()"""
+    with open(filename, "rb") as file:
+        stat = os.fstat(file.fileno())
+        data = file.read()
+    return data, fingerprint(data, stat)
+
+
+def fingerprint(data, stat):
+    """returns the Fingerprint of data, the contents of a file whose
+    os.stat() result, stat, was taken before they were read (so if the
+    file changed while being read its validator won't match later)"""
+    return Fingerprint([stat.st_mtime_ns, stat.st_size],
+            hashlib.sha256(data).hexdigest())
+
+
+def file_hash(filename, blocksize=1 << 20):
+    """returns the hex SHA-256 digest of the file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -13,14 +13,16 @@
 # Throughout, pixels and newPixels are really of type
 # numpy.ndarray[_DTYPE_t] but using a memory view is almost 4x faster
 
-from libc.math cimport round
+# C rint() rounds halves to even just like Python round() so results
+# match Scale.Slow and Image.scale() exactly
+from libc.math cimport rint as round
 import numpy
 cimport numpy
 cimport cython
+from cython.parallel cimport prange
 
 
-# See: http://docs.cython.org/src/tutorial/numpy.html
-_DTYPE = numpy.uint32
+_DTYPE = numpy.uint32 # See: http://docs.cython.org/src/tutorial/numpy.html
 ctypedef numpy.uint32_t _DTYPE_t
 
 cdef struct Argb:
@@ -33,12 +35,16 @@ DEF MAX_COMPONENT = 0xFF
 
 
 @cython.boundscheck(False)
-def scale(_DTYPE_t[:] pixels, int width, int height, double ratio):
+def scale(_DTYPE_t[:] pixels, int width, int height, double ratio,
+        int workers=1):
     """returns a smoothly scaled copy of this image
 
     ratio is how much to scale by, e.g., 0.75 means reduce width and
     height to ¾ their original size, 0.5 to half (making the image ¼
     of the original size), and so on.
+
+    If workers > 1 the rows are shared between that many OpenMP threads
+    with the GIL released; the result is the same for any workers.
     """
     assert 0 < ratio < 1
     cdef int rows = <int>round(height * ratio)
@@ -46,58 +52,162 @@ def scale(_DTYPE_t[:] pixels, int width, int height, double ratio):
     cdef _DTYPE_t[:] newPixels = numpy.zeros(rows * columns, dtype=_DTYPE)
     cdef double yStep = height / rows
     cdef double xStep = width / columns
-    cdef int index = 0
     cdef int row, column, y0, y1, x0, x1
-    for row in range(rows):
+    for row in prange(rows, nogil=True, schedule="static",
+            num_threads=max(1, workers)):
         y0 = <int>round(row * yStep)
         y1 = <int>round(y0 + yStep)
         for column in range(columns):
             x0 = <int>round(column * xStep)
             x1 = <int>round(x0 + xStep)
-            newPixels[index] = _mean(pixels, width, height, x0, y0, x1, y1)
-            index += 1
+            newPixels[row * columns + column] = _mean(pixels, width,
+                    height, x0, y0, x1, y1)
     return columns, newPixels
 
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
 cdef _DTYPE_t _mean(_DTYPE_t[:] pixels, int width, int height, int x0,
-        int y0, int x1, int y1):
-    cdef int alphaTotal = 0
-    cdef int redTotal = 0
-    cdef int greenTotal = 0
-    cdef int blueTotal = 0
+        int y0, int x1, int y1) noexcept nogil:
+    # The color is weighted by alpha (i.e., premultiplied) so that
+    # transparent pixels don't darken their neighbors; the products need
+    # 64-bit totals for big boxes
+    cdef long long alphaTotal = 0
+    cdef long long redTotal = 0
+    cdef long long greenTotal = 0
+    cdef long long blueTotal = 0
     cdef int count = 0
     cdef int y, x, offset
     cdef Argb argb
     for y in range(y0, y1):
         if y >= height:
             break
-        offset = y * width
+        offset = y * width # Compute this per row rather than per pixel
         for x in range(x0, x1):
             if x >= width:
                 break
             argb = _argb_for_color(pixels[offset + x])
             alphaTotal += argb.alpha
-            redTotal += argb.red
-            greenTotal += argb.green
-            blueTotal += argb.blue
+            redTotal += argb.red * argb.alpha
+            greenTotal += argb.green * argb.alpha
+            blueTotal += argb.blue * argb.alpha
             count += 1
-    cdef int a = <int>round(alphaTotal / count)
-    cdef int r = <int>round(redTotal / count)
-    cdef int g = <int>round(greenTotal / count)
-    cdef int b = <int>round(blueTotal / count)
+    if alphaTotal == 0:
+        return 0 # All transparent
+    cdef int a = <int>round(<double>alphaTotal / count)
+    cdef int r = <int>round(<double>redTotal / alphaTotal)
+    cdef int g = <int>round(<double>greenTotal / alphaTotal)
+    cdef int b = <int>round(<double>blueTotal / alphaTotal)
     return _color_for_argb(a, r, g, b)
 
 
-cdef inline Argb _argb_for_color(_DTYPE_t color):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def resample(_DTYPE_t[:] pixels, int width, int height,
+        Py_ssize_t[:, :] xIndices, double[:, :] xWeights,
+        Py_ssize_t[:, :] yIndices, double[:, :] yWeights, int workers=1):
+    """returns the pixels of the width x height image resampled to
+    len(xIndices) x len(yIndices)
+
+    Each new column (row) is the weighted sum of the source columns
+    (rows) given by the corresponding row of xIndices and xWeights
+    (yIndices and yWeights), as computed by Image.Resampler; colors are
+    premultiplied by alpha while they are filtered. This is the kernel
+    of Image.resample() and gives the same results as its other
+    implementations.
+
+    If workers > 1 the rows are shared between that many OpenMP threads
+    with the GIL released; the result is the same for any workers.
+    """
+    cdef int newWidth = xIndices.shape[0]
+    cdef int newHeight = yIndices.shape[0]
+    cdef double[:, :, :] rows = numpy.empty((height, newWidth, 4))
+    cdef _DTYPE_t[:] newPixels = numpy.zeros(newWidth * newHeight,
+            dtype=_DTYPE)
+    cdef int y
+    for y in prange(height, nogil=True, schedule="static",
+            num_threads=max(1, workers)):
+        _filter_row(pixels, width, y, xIndices, xWeights, rows)
+    for y in prange(newHeight, nogil=True, schedule="static",
+            num_threads=max(1, workers)):
+        _filter_column(rows, y, yIndices, yWeights, newPixels)
+    return newPixels
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _filter_row(_DTYPE_t[:] pixels, int width, int y,
+        Py_ssize_t[:, :] indices, double[:, :] weights,
+        double[:, :, :] rows) noexcept nogil:
+    # The sums are accumulated tap by tap in the same order as
+    # Image._resample_numpy() so that the results are identical
+    cdef Py_ssize_t column, tap
+    cdef double weight, alpha, red, green, blue
+    cdef Argb argb
+    for column in range(indices.shape[0]):
+        alpha = red = green = blue = 0.0
+        for tap in range(indices.shape[1]):
+            weight = weights[column, tap]
+            argb = _argb_for_color(pixels[y * width + indices[column, tap]])
+            alpha = alpha + weight * argb.alpha
+            red = red + weight * (<double>(argb.red * argb.alpha) /
+                    MAX_COMPONENT)
+            green = green + weight * (<double>(argb.green * argb.alpha) /
+                    MAX_COMPONENT)
+            blue = blue + weight * (<double>(argb.blue * argb.alpha) /
+                    MAX_COMPONENT)
+        rows[y, column, 0] = alpha
+        rows[y, column, 1] = red
+        rows[y, column, 2] = green
+        rows[y, column, 3] = blue
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _filter_column(double[:, :, :] rows, int row,
+        Py_ssize_t[:, :] indices, double[:, :] weights,
+        _DTYPE_t[:] newPixels) noexcept nogil:
+    cdef int newWidth = rows.shape[1]
+    cdef Py_ssize_t column, tap, y
+    cdef double weight, alpha, red, green, blue
+    for column in range(newWidth):
+        alpha = red = green = blue = 0.0
+        for tap in range(indices.shape[1]):
+            weight = weights[row, tap]
+            y = indices[row, tap]
+            alpha = alpha + weight * rows[y, column, 0]
+            red = red + weight * rows[y, column, 1]
+            green = green + weight * rows[y, column, 2]
+            blue = blue + weight * rows[y, column, 3]
+        newPixels[row * newWidth + column] = _straight_color(alpha, red,
+                green, blue)
+
+
+cdef inline _DTYPE_t _straight_color(double alpha, double red,
+        double green, double blue) noexcept nogil:
+    """returns a numpy.uint32 for the premultiplied ARGB values clamped
+    to the valid range"""
+    alpha = min(max(alpha, 0.0), MAX_COMPONENT)
+    if alpha == 0:
+        return 0
+    return _color_for_argb(<int>round(alpha), _straight(red, alpha),
+            _straight(green, alpha), _straight(blue, alpha))
+
+
+cdef inline int _straight(double component, double alpha) noexcept nogil:
+    return <int>round(min(max(component, 0.0), alpha) * MAX_COMPONENT /
+            alpha)
+
+
+cdef inline Argb _argb_for_color(_DTYPE_t color) noexcept nogil:
     """returns an ARGB quadruple for a color specified as a numpy.uint32"""
     return Argb((color >> 24) & MAX_COMPONENT,
             (color >> 16) & MAX_COMPONENT, (color >> 8) & MAX_COMPONENT,
             (color & MAX_COMPONENT))
 
 
-cdef inline _DTYPE_t _color_for_argb(int a, int r, int g, int b):
+cdef inline _DTYPE_t _color_for_argb(int a, int r, int g,
+        int b) noexcept nogil:
     """returns a numpy.uint32 representing the given ARGB values"""
     return (((a & MAX_COMPONENT) << 24) | ((r & MAX_COMPONENT) << 16) |
             ((g & MAX_COMPONENT) << 8) | (b & MAX_COMPONENT))
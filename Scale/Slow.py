@@ -15,12 +15,13 @@ import numpy
 MAX_COMPONENT = 0xFF
 
 
-def scale(pixels, width, height, ratio):
+def scale(pixels, width, height, ratio, workers=1):
     """returns a smoothly scaled copy of this image
 
     ratio is how much to scale by, e.g., 0.75 means reduce width and
     height to ¾ their original size, 0.5 to half (making the image ¼
-    of the original size), and so on.
+    of the original size), and so on. workers is ignored: it is for
+    compatibility with Scale.Fast.
 
     Scaling is slow but produces good results even for text;
     subsample() is faster.
@@ -44,6 +45,8 @@ def scale(pixels, width, height, ratio):
 
 
 def _mean(pixels, width, height, x0, y0, x1, y1):
+    # The color is weighted by alpha (i.e., premultiplied) so that
+    # transparent pixels don't darken their neighbors
     alphaTotal, redTotal, greenTotal, blueTotal, count = 0, 0, 0, 0, 0
     for y in range(y0, y1):
         if y >= height:
@@ -54,14 +57,16 @@ def _mean(pixels, width, height, x0, y0, x1, y1):
                 break
             a, r, g, b = _argb_for_color(pixels[offset + x])
             alphaTotal += a
-            redTotal += r
-            greenTotal += g
-            blueTotal += b
+            redTotal += r * a
+            greenTotal += g * a
+            blueTotal += b * a
             count += 1
+    if not alphaTotal:
+        return 0 # All transparent
     a = int(round(alphaTotal / count))
-    r = int(round(redTotal / count))
-    g = int(round(greenTotal / count))
-    b = int(round(blueTotal / count))
+    r = int(round(redTotal / alphaTotal))
+    g = int(round(greenTotal / alphaTotal))
+    b = int(round(blueTotal / alphaTotal))
     return _color_for_argb(a, r, g, b)
 
 
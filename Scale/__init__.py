@@ -9,5 +9,29 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
 # General Public License for more details.
 
+"""
+scale_slow() is the pure Python scaler and scale_fast() the compiled
+Cython one from Fast.pyx; both have the signature
+scale(pixels, width, height, ratio, workers=1) and give identical
+results. Build Scale.Fast with: python3 Scale/setup.py build_ext --inplace
+
+If Scale.Fast hasn't been built (or won't import) scale_fast() falls
+back to scale_slow(), which is about 100x slower, and warns that it has
+done so; COMPILED says whether scale_fast() is really compiled.
+"""
+
+import warnings
 from Scale.Slow import scale as scale_slow
-from Scale.Scale.Fast import scale as scale_fast
+try:
+    from Scale.Fast import scale as scale_fast
+    COMPILED = True
+except ImportError as err:
+    COMPILED = False
+    _reason = str(err)
+
+    def scale_fast(pixels, width, height, ratio, workers=1):
+        warnings.warn("Scale.Fast is unavailable ({}) so the much slower "
+                "Scale.Slow is being used; build it with: python3 "
+                "Scale/setup.py build_ext --inplace".format(_reason),
+                RuntimeWarning, stacklevel=2)
+        return scale_slow(pixels, width, height, ratio, workers)
@@ -9,13 +9,16 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
 # General Public License for more details.
 
-# Build with: python3 setup.py build_ext --inplace
 
-import distutils.core
-import numpy
-import Cython.Build
+# Build with: python3 Scale/setup.py build_ext --inplace
+# (or python3 setup.py build_ext --inplace from inside Scale/); set
+# OPENMP=0 to build without OpenMP (see CythonBuild.py)
 
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__)))) # For CythonBuild
+import CythonBuild
 
-distutils.core.setup(name="Scale.Fast",
-        include_dirs=[numpy.get_include()],
-        ext_modules=Cython.Build.cythonize("Fast.pyx"))
+
+CythonBuild.build("Scale", [CythonBuild.scale_fast()])
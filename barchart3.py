@@ -94,6 +94,7 @@ class ImageBarRenderer:
         color = Image.color_for_name("white")
         self.image = Image.Image(bars * (self.barWidth + self.barGap),
                 maximum * self.stepHeight, background=color)
+        self.bars = []
 
 
     def draw_caption(self, caption):
@@ -109,11 +110,12 @@ class ImageBarRenderer:
         x1 = x0 + self.barWidth
         y0 = height - (value * self.stepHeight)
         y1 = height - 1
-        self.image.rectangle(x0, y0, x1, y1, fill=color)
+        self.bars.append((Image.RECTANGLE, x0, y0, x1, y1, None, color))
         self.index += 1
 
 
     def finalize(self):
+        self.image.draw(self.bars) # All the bars in one call
         self.image.save(self.filename)
         print("wrote", self.filename)
 
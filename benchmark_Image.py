@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+"""
+Benchmarks every available image backend (Image, cyImage, Scale.Slow,
+Scale.Fast) side by side on synthetic images of various sizes and
+numbers of colors, timing load and save (for each format the backend
+supports), scale, subsample, resample, blit, line, rectangle, and
+ellipse.
+
+The results are written as JSON (to stdout or --output); each records
+the median, 95th percentile and minimum of --repeat runs (after --warmup
+untimed runs) and the process's peak RSS so far. Save the JSON from a
+known-good tree and use --compare with it later to report the cases
+that have become slower (the exit status is 1 if any has).
+
+Backends that can't be imported (e.g., unbuilt Cython modules) are
+skipped; to add another backend add a function to BACKENDS that returns
+an object with the methods of Backend, or None if it is unavailable.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+OPERATIONS = ("load", "save", "scale", "subsample", "resample", "blit",
+        "line", "rectangle", "ellipse")
+
+
+def main():
+    args = parse_commandline()
+    backends = [backend for backend in (create(args.seed) for create in
+            (BACKENDS[name] for name in args.backends)) if backend is not
+            None]
+    directory = tempfile.mkdtemp()
+    try:
+        results = []
+        for backend in backends:
+            for width, height in args.sizes:
+                for colors in args.colors:
+                    results += benchmark(backend, width, height, colors,
+                            args, directory)
+    finally:
+        shutil.rmtree(directory)
+    report = dict(meta=meta(args, backends), results=results)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "wt", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "rt", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+def parse_commandline():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-b", "--backends", nargs="+",
+            choices=sorted(BACKENDS), default=sorted(BACKENDS),
+            help="the backends to benchmark [default: all available]")
+    parser.add_argument("-o", "--operations", nargs="+",
+            choices=OPERATIONS, default=OPERATIONS,
+            help="the operations to benchmark [default: all]")
+    parser.add_argument("-s", "--sizes", nargs="+", type=size,
+            default=[size("128x96"), size("512x384"), size("1024x768")],
+            help="the image sizes as WIDTHxHEIGHT [default: 128x96 "
+                "512x384 1024x768]")
+    parser.add_argument("-c", "--colors", nargs="+", type=int,
+            default=[2, 256, 4096],
+            help="how many distinct colors each image has [default: "
+                "%(default)s]")
+    parser.add_argument("-f", "--formats", nargs="+",
+            default=["xpm", "xbm", "png", "argb"],
+            help="the file formats to load and save with [default: "
+                "%(default)s]")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+            help="how many timed runs of each case [default: "
+                "%(default)d]")
+    parser.add_argument("-w", "--warmup", type=int, default=1,
+            help="how many untimed runs precede the timed ones [default: "
+                "%(default)d]")
+    parser.add_argument("--seed", type=int, default=1,
+            help="the random seed for the synthetic images [default: "
+                "%(default)d]")
+    parser.add_argument("--output",
+            help="write the JSON to this file rather than stdout")
+    parser.add_argument("--compare", metavar="BASELINE",
+            help="a JSON file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+            help="with --compare, how much slower (as a fraction) a "
+                "median may be before it counts as a regression "
+                "[default: %(default).2f]")
+    args = parser.parse_args()
+    if args.repeat < 1 or args.warmup < 0:
+        parser.error("--repeat must be at least 1 and --warmup at least 0")
+    return args
+
+
+def size(text):
+    try:
+        width, height = (int(x) for x in text.lower().split("x"))
+        if width > 0 and height > 0:
+            return width, height
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError("invalid size '{}'".format(text))
+
+
+class Backend:
+    """The interface every backend provides: prepare() returns None for
+    any operation the backend doesn't support, otherwise a function that
+    takes no arguments and performs the operation once."""
+
+    name = None
+    formats = ()
+
+    def __init__(self, seed):
+        self.seed = seed
+
+
+    def prepare(self, operation, width, height, colors, filename):
+        return None
+
+
+class ImageBackend(Backend):
+
+    def __init__(self, seed, module, name, formats):
+        super().__init__(seed)
+        self.module = module
+        self.name = name
+        self.formats = formats
+
+
+    def prepare(self, operation, width, height, colors, filename):
+        image = self.module.Image.from_data(width, synthetic_pixels(width,
+                height, colors, self.seed))
+        if operation == "load":
+            image.save(filename)
+            return lambda: self.module.Image.from_file(filename)
+        if operation == "save":
+            return lambda: image.save(filename)
+        if operation == "scale":
+            return lambda: image.scale(0.5)
+        if operation == "subsample":
+            return lambda: image.subsample(2)
+        if operation == "resample":
+            if not hasattr(image, "resample"):
+                return None
+            return lambda: image.resample(width * 3 // 4, height * 3 // 4)
+        if operation == "blit": # A 4 x 4 contact sheet of quarter tiles
+            if not hasattr(image, "blit"):
+                return None
+            tile = image.crop(0, 0, width // 4, height // 4)
+            def blits():
+                for y in range(0, height, height // 4 or 1):
+                    for x in range(0, width, width // 4 or 1):
+                        image.blit(tile, x, y)
+            return blits
+        color = Image.color_for_name("red")
+        if operation == "line":
+            def lines():
+                for x in range(0, width, max(1, width // 32)):
+                    image.line(x, 0, width - 1 - x, height - 1, color)
+                for y in range(0, height, max(1, height // 32)):
+                    image.line(0, y, width - 1, height - 1 - y, color)
+            return lines
+        if operation == "rectangle":
+            return lambda: image.rectangle(width // 8, height // 8,
+                    width - width // 8, height - height // 8,
+                    outline=color, fill=color)
+        if operation == "ellipse":
+            return lambda: image.ellipse(width // 8, height // 8,
+                    width - width // 8, height - height // 8,
+                    outline=color, fill=color)
+
+
+class ScaleBackend(Backend):
+    """Scale.Slow and Scale.Fast only scale raw pixels"""
+
+    def __init__(self, seed, function, name):
+        super().__init__(seed)
+        self.function = function
+        self.name = name
+
+
+    def prepare(self, operation, width, height, colors, filename):
+        if operation != "scale" or numpy is None:
+            return None
+        pixels = numpy.asarray(synthetic_pixels(width, height, colors,
+                self.seed), dtype=numpy.uint32)
+        return lambda: self.function(pixels, width, height, 0.5)
+
+
+def image_backend(seed):
+    return ImageBackend(seed, Image, "Image", ("xpm", "xbm", "png",
+            "argb"))
+
+
+def cyimage_backend(seed):
+    try:
+        import cyImage
+    except ImportError:
+        return None
+    return ImageBackend(seed, cyImage, "cyImage", ("xpm", "xbm"))
+
+
+def scale_slow_backend(seed):
+    try:
+        from Scale.Slow import scale
+    except ImportError:
+        return None
+    return ScaleBackend(seed, scale, "Scale.Slow")
+
+
+def scale_fast_backend(seed):
+    try:
+        from Scale.Fast import scale
+    except ImportError:
+        return None
+    return ScaleBackend(seed, scale, "Scale.Fast")
+
+
+BACKENDS = {"Image": image_backend, "cyImage": cyimage_backend,
+        "Scale.Slow": scale_slow_backend, "Scale.Fast": scale_fast_backend}
+
+
+def benchmark(backend, width, height, colors, args, directory):
+    results = []
+    for operation in args.operations:
+        formats = ([fmt for fmt in args.formats if fmt in backend.formats]
+                if operation in {"load", "save"} else [None])
+        for fmt in formats:
+            filename = os.path.join(directory, "image.{}".format(fmt))
+            function = backend.prepare(operation, width, height, colors,
+                    filename)
+            if function is None:
+                continue
+            for _ in range(args.warmup):
+                function()
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+            result = dict(backend=backend.name, operation=operation,
+                    format=fmt, width=width, height=height, colors=colors)
+            result.update(summary(times))
+            results.append(result)
+            print("{backend} {operation} {format} {width}x{height} "
+                    "{colors} colors: {median:.4f} sec".format(**result),
+                    file=sys.stderr)
+    return results
+
+
+def summary(times):
+    times = sorted(times)
+    # Nearest-rank percentile so that small repeat counts still give an
+    # actual measured time
+    p95 = times[max(0, math.ceil(len(times) * 0.95) - 1)]
+    return dict(median=statistics.median(times), p95=p95, min=times[0],
+            runs=len(times), peak_rss_kib=peak_rss_kib())
+
+
+def peak_rss_kib():
+    # This is the process's high-water mark, so it only grows
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak # Mac: bytes
+
+
+def synthetic_pixels(width, height, colors, seed):
+    # Pixels drawn from a palette of the given number of solid colors so
+    # that palette-based formats (XPM) see realistic color counts
+    rand = random.Random(seed)
+    palette = [Image.SOLID | rand.randrange(0x1000000)
+            for _ in range(colors)]
+    if numpy is not None:
+        generator = numpy.random.default_rng(seed)
+        return numpy.array(palette, dtype=numpy.uint32)[generator.integers(
+                0, colors, width * height)]
+    pixels = Image.create_array(width, height)
+    for i in range(width * height):
+        pixels[i] = palette[rand.randrange(colors)]
+    return pixels
+
+
+def meta(args, backends):
+    return dict(date=datetime.datetime.now().isoformat(timespec="seconds"),
+            python=platform.python_version(), platform=platform.platform(),
+            cpus=os.cpu_count(), numpy=getattr(numpy, "__version__", None),
+            backends=[backend.name for backend in backends],
+            warmup=args.warmup, repeat=args.repeat)
+
+
+def compare(baseline, report, threshold):
+    """prints how each case's median compares with the baseline's and
+    returns True if any is more than threshold slower"""
+    def key(result):
+        return (result["backend"], result["operation"], result["format"],
+                result["width"], result["height"], result["colors"])
+    old = {key(result): result for result in baseline["results"]}
+    regressed = False
+    for result in report["results"]:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"]
+        verdict = ""
+        if ratio > 1 + threshold:
+            verdict = " REGRESSION"
+            regressed = True
+        elif ratio < 1 - threshold:
+            verdict = " improved"
+        print("{} {} {} {}x{} {} colors: {:.4f} -> {:.4f} sec "
+                "({:.2f}x){}".format(*key(result), before["median"],
+                result["median"], ratio, verdict), file=sys.stderr)
+    return regressed
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,10 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-P", "--noprofile", action="store_true",
             help="only use inside a regression.py file")
+    parser.add_argument("-w", "--workers", type=int,
+            default=os.cpu_count() or 1,
+            help="the most workers to report parallel scaling speedups "
+                "for [default: %(default)d]")
     parser.add_argument("image", nargs="?", default=os.path.join(
             os.path.dirname(__file__), "regressiondata/photo.xpm"),
             help="image filename [default %(default)s]")
@@ -99,6 +103,11 @@ def main():
     for filename, function in filenames:
         save(image, filename, function, profile)
 
+    if not profile:
+        scale_workers(image, "Image", args.workers)
+        if cyImage is not None:
+            scale_workers(image1, "cyImage", args.workers)
+
 
 def scale(image, function, profile):
     if profile:
@@ -107,6 +116,29 @@ def scale(image, function, profile):
                 "image.height, 0.5)".format(function), globals(), locals())
 
 
+def scale_workers(image, name, maximum):
+    # Reports the speedup of scale() for 1, 2, 4, ... maximum workers and
+    # checks that the scaled pixels are always the same
+    counts = [1]
+    while counts[-1] * 2 < maximum:
+        counts.append(counts[-1] * 2)
+    if maximum > 1:
+        counts.append(maximum)
+    single = pixels = None
+    for workers in counts:
+        start = time.time()
+        scaled = image.scale(0.5, workers=workers)
+        end = time.time() - start
+        if single is None:
+            single, pixels = end, bytes(memoryview(scaled.pixels))
+        elif bytes(memoryview(scaled.pixels)) != pixels:
+            raise AssertionError("{}.scale(workers={}) differs".format(
+                    name, workers))
+        print("Scaled with {}.scale(workers={}) in {:.3f} sec (speedup "
+                "{:.1f}x on {} cores)".format(name, workers, end,
+                single / end, os.cpu_count()))
+
+
 def save(image, name, function, profile):
     filename = os.path.join(tempfile.gettempdir(), name + ".xpm")
     start = time.time()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+import argparse
+import os
+import tempfile
+import time
+import Image
+import Image.Xpm as Xpm
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+            help="how many times to load the image [default: "
+                "%(default)d]")
+    parser.add_argument("-s", "--size", default="2048x1536",
+            help="the size of the synthetic image to use if the image "
+                "doesn't exist [default: %(default)s]")
+    parser.add_argument("image", nargs="?", default=os.path.join(
+            os.path.dirname(__file__), "regressiondata/photo.xpm"),
+            help="image filename [default %(default)s]")
+    args = parser.parse_args()
+    filename = args.image
+    if not os.path.exists(filename):
+        width, height = (int(x) for x in args.size.split("x"))
+        filename = os.path.join(tempfile.gettempdir(), "photo.xpm")
+        print("Creating {}x{} {}...".format(width, height, filename))
+        create_photo(width, height).save(filename)
+
+    lines = None
+    for name, function in (("line by line", load_lines),
+            ("bulk", Xpm.load)):
+        best = None
+        for _ in range(args.repeat):
+            image = Image.Image.create(0, 0)
+            start = time.time()
+            function(image, filename)
+            end = time.time() - start
+            best = end if best is None else min(best, end)
+        print("Loaded {} {} in {:.3f} sec".format(image, name, best))
+        if lines is None:
+            lines = (best, list(image.pixels))
+        else:
+            assert lines[1] == list(image.pixels), "pixels differ"
+            print("Speedup {:.1f}x".format(lines[0] / best))
+
+
+def load_lines(image, filename):
+    with open(filename, "rt", encoding="ascii") as file:
+        Xpm._load_lines(image, file.read().split("\n"))
+
+
+def create_photo(width, height):
+    # Smooth gradients with thousands of colors need 2 chars per pixel
+    # just like a real photograph
+    image = Image.Image.create(width, height)
+    for y in range(height):
+        offset = y * width
+        green = (y * 16 // height) << 12
+        for x in range(width):
+            image.pixels[offset + x] = (Image.SOLID | green |
+                    ((x * 16 // width) << 20) | (((x + y) % 16) << 4))
+    return image
+
+
+if __name__ == "__main__":
+    main()
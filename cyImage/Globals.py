@@ -10,6 +10,7 @@
 # General Public License for more details.
 
 import collections
+import functools
 import numpy
 import os
 import re
@@ -19,6 +20,9 @@ CLEAR_ALPHA = 0x00FFFFFF # & to ARGB color int to get rid of alpha channel
 MAX_ARGB = 0xFFFFFFFF
 MAX_COMPONENT = 0xFF
 SOLID = 0xFF000000 # + to RGB color int to get a solid ARGB color int
+# Image.draw() command kinds; NO_COLOR is for an absent outline or fill
+LINE, RECTANGLE, ELLIPSE = range(3)
+NO_COLOR = -1
 
 
 class Error(Exception): pass
@@ -89,11 +93,23 @@ def color_for_name(name):
     """returns an ARGB int for a color specified as an int or
     a color name or an #HHH, #HHHH, #HHHHHH or #HHHHHHHH RGB
     str---in the latter case the alpha channel is set to 0xFF
-    (solid) if not specified"""
+    (solid) if not specified; X11's #HHHHHHHHH and #HHHHHHHHHHHH
+    are accepted too. Results are cached."""
     if name is None:
         return ColorForName["transparent"]  
+    return _color_for_name(name)
+
+
+@functools.lru_cache(maxsize=4096)
+def _color_for_name(name):
+    # Cached by the raw string since XPM palettes and drawing code parse
+    # the same names and hex strings over and over
     if name.startswith("#"):
         name = name[1:]
+        if len(name) in {9, 12}: # X11 #RRRGGGBBB or #RRRRGGGGBBBB
+            size = len(name) // 3 # Keep each component's top 8 bits
+            name = "FF" + "".join(name[i:i + 2]
+                                  for i in range(0, len(name), size))
         if len(name) == 3: # add solid alpha
             name = "F" + name # now has 4 hex digits
         if len(name) == 6: # add solid alpha
@@ -104,9 +120,9 @@ def color_for_name(name):
                 components.extend([h, h])
             name = "".join(components) # now has the full 8 hex digits
         return int(name, 16)
-    return ColorForName[name.lower()]
-    # ColorForName is a default dict so will always return a color,
-    # e.g., black
+    # Not ColorForName[name] since that would add unknown names to it
+    color = ColorForName.get(name.lower())
+    return color if color is not None else ColorForName.default_factory()
 
 
 # Taken from rgb.txt and converted to ARGB (with the addition of
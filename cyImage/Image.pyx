@@ -30,13 +30,22 @@ cimport numpy
 cimport cython
 import cyImage.cyImage.Xbm as Xbm
 import cyImage.cyImage.Xpm as Xpm
-import cyImage.cyImage._Scale as Scale
+from Scale import scale_fast # The same kernel as Image's fastest
 from cyImage.Globals import *
 
 
 _DTYPE = numpy.uint32 # See: http://docs.cython.org/src/tutorial/numpy.html
 ctypedef numpy.uint32_t _DTYPE_t
 
+# C versions of the draw() command kinds and NO_COLOR from Globals for
+# use with the GIL released
+cdef enum:
+    _LINE = 0
+    _RECTANGLE = 1
+    _ELLIPSE = 2
+    _NO_COLOR = -1
+    _MAX_COMPONENT = 0xFF
+
 
 class Image:
 
@@ -121,28 +130,11 @@ class Image:
         self.pixels[(y * self.width) + x] = color
 
 
-    # Bresenham's mid-point line scanning algorithm from 
-    # http://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm 
     def line(self, int x0, int y0, int x1, int y1, _DTYPE_t color):
         """draws the line in the given color; the coordinates must be in
         range; the color must be an ARGB int"""
-        cdef int dx = abs(x1 - x0)
-        cdef int dy = abs(y1 - y0)
-        cdef int xInc = 1 if x0 < x1 else -1
-        cdef int yInc = 1 if y0 < y1 else -1
-        cdef int err = dx - dy
-        cdef int err2
-        while True:
-            self.set_pixel(x0, y0, color)
-            if x0 == x1 and y0 == y1:
-                break
-            err2 = 2 * err
-            if err2 > -dy:
-                err -= dy
-                x0 += xInc
-            if err2 < dx:
-                err += dx
-                y0 += yInc
+        self._check_range(x0, y0, x1, y1)
+        _line(self.pixels, self.width, x0, y0, x1, y1, color)
 
 
     def rectangle(self, int x0, int y0, int x1, int y1, outline=None,
@@ -153,21 +145,9 @@ class Image:
         the coordinates must be in range; the outline and fill colors
         must be ARGB ints"""
         assert outline is not None or fill is not None
-        if fill is not None:
-            if y0 > y1:
-                y0, y1 = y1, y0
-            if outline is not None: # no point drawing over the outline
-                x0 += 1
-                x1 -= 1
-                y0 += 1
-                y1 -= 1
-            for y in range(y0, y1 + 1):
-                self.line(x0, y, x1, y, fill)
-        if outline is not None:
-            self.line(x0, y0, x1, y0, outline)
-            self.line(x1, y0, x1, y1, outline)
-            self.line(x1, y1, x0, y1, outline)
-            self.line(x0, y1, x0, y0, outline)
+        self._check_range(x0, y0, x1, y1)
+        _rectangle(self.pixels, self.width, x0, y0, x1, y1,
+                _color_or_none(outline), _color_or_none(fill))
 
 
     def ellipse(self, int x0, int y0, int x1, int y1, outline=None,
@@ -178,76 +158,110 @@ class Image:
         the coordinates must be in range; the outline and fill colors
         must be ARGB ints"""
         assert outline is not None or fill is not None
-        if x0 > x1:
-            x0, x1 = x1, x0
-        if y0 > y1:
-            y0, y1 = y1, y0
-        cdef int width = x1 - x0
-        cdef int height = y1 - y0
-        cdef int halfWidth, halfHeight, midX, midY
-        cdef double dx, dy, a, b, a2, b2, p
-        if fill is not None:
-            # Algorithm based on
-            # http://stackoverflow.com/questions/10322341/
-            # simple-algorithm-for-drawing-filled-ellipse-in-c-c
-            halfWidth = width // 2
-            halfHeight = height // 2
-            midX = x0 + halfWidth
-            midY = y0 + halfHeight
-            for y in range(-halfHeight, halfHeight + 1):
-                for x in range(-halfWidth, halfWidth + 1):
-                    dx =  x / halfWidth
-                    dy =  y / halfHeight
-                    if ((dx * dx) + (dy * dy)) <= 1:
-                        self.set_pixel(<int>round(midX + x),
-                                       <int>round(midY + y), fill)
-        if outline is not None:
-            # Midpoint ellipse algorithm from "Computer Graphics
-            # Principles and Practice".
-            if x1 > x0:
-                midX = ((x1 - x0) // 2) + x0
-            else:
-                midX = ((x0 - x1) // 2) + x1
-            if y1 > y0:
-                midY = ((y1 - y0) // 2) + y0
-            else:
-                midY = ((y0 - y1) // 2) + y1
-
-            def ellipse_point(dx, dy):
-                # dx is always an int; dy is always a float
-                self.set_pixel(midX + dx, <int>round(midY + dy), outline)
-                self.set_pixel(midX - dx, <int>round(midY - dy), outline)
-                self.set_pixel(midX + dx, <int>round(midY - dy), outline)
-                self.set_pixel(midX - dx, <int>round(midY + dy), outline)
-
-            a = abs(x1 - x0) / 2
-            b = abs(y1 - y0) / 2
-            a2 = a ** 2
-            b2 = b ** 2
-            dx = 0
-            dy = b
-            p = b2 - (a2 * b) + (a2 / 4)
-            ellipse_point(dx, dy)
-            while (a2 * (dy - 0.5)) > (b2 * (dx + 1)):
-                if p < 0:
-                    p += b2 * ((2 * dx) + 3)
-                    dx += 1
+        self._check_range(x0, y0, x1, y1)
+        _ellipse(self.pixels, self.width, self.height, x0, y0, x1, y1,
+                _color_or_none(outline), _color_or_none(fill))
+
+
+    @cython.boundscheck(False) # The commands are checked beforehand
+    @cython.wraparound(False)
+    def draw(self, commands):
+        """draws all the commands in a single loop with the GIL released
+
+        commands is either a sequence of (kind, x0, y0, x1, y1, outline,
+        fill) tuples or an equivalent (n, 7) numpy integer array. kind
+        is LINE, RECTANGLE, or ELLIPSE; the outline and fill are ARGB
+        ints or None or NO_COLOR (a line is drawn in its outline color).
+        This is the same as calling line(), rectangle() and ellipse()
+        for each command in turn but costs only one Python call."""
+        cdef numpy.int64_t[:, :] table = self._command_table(commands)
+        cdef _DTYPE_t[:] pixels = self.pixels
+        cdef int width = self.width
+        cdef int height = self.height
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(table.shape[0]):
+                if table[i, 0] == _LINE:
+                    _line(pixels, width, table[i, 1], table[i, 2],
+                            table[i, 3], table[i, 4], table[i, 5])
+                elif table[i, 0] == _RECTANGLE:
+                    _rectangle(pixels, width, table[i, 1], table[i, 2],
+                            table[i, 3], table[i, 4], table[i, 5],
+                            table[i, 6])
                 else:
-                    p += (b2 * ((2 * dx) + 3)) + (a2 * ((-2 * dy) + 2))
-                    dx += 1
-                    dy -= 1
-                ellipse_point(dx, dy)
-            p = ((b2 * ((dx + 0.5) ** 2)) + (a2 * ((dy - 1) ** 2)) -
-                 (a2 * b2))
-            while dy > 0:
-                if p < 0:
-                    p += (b2 * ((2 * dx) + 2)) + (a2 * ((-2 * dy) + 3))
-                    dx += 1
-                    dy -= 1
-                else:
-                    p += a2 * ((-2 * dy) + 3)
-                    dy -= 1
-                ellipse_point(dx, dy)
+                    _ellipse(pixels, width, height, table[i, 1],
+                            table[i, 2], table[i, 3], table[i, 4],
+                            table[i, 5], table[i, 6])
+
+
+    def _command_table(self, commands):
+        # Returns the commands as an (n, 7) int64 array having checked
+        # them all since nothing can be checked with the GIL released
+        if not isinstance(commands, numpy.ndarray):
+            commands = [[NO_COLOR if value is None else value
+                         for value in command] for command in commands]
+        table = numpy.array(commands, dtype=numpy.int64).reshape(-1, 7)
+        kinds = table[:, 0]
+        if not numpy.isin(kinds, (LINE, RECTANGLE, ELLIPSE)).all():
+            raise Error("invalid draw command kind")
+        if ((table[:, (1, 3)] < 0).any() or (table[:, (2, 4)] < 0).any()
+                or (table[:, (1, 3)] >= self.width).any() or
+                (table[:, (2, 4)] >= self.height).any()):
+            raise Error("draw command coordinates out of range")
+        colors = table[:, 5:]
+        if (((colors < NO_COLOR) | (colors > MAX_ARGB)).any() or
+                ((colors[:, 0] == NO_COLOR) & ((kinds == LINE) |
+                 (colors[:, 1] == NO_COLOR))).any()):
+            raise Error("invalid or missing draw command color")
+        return table
+
+
+    def _check_range(self, int x0, int y0, int x1, int y1):
+        if not (0 <= x0 < self.width and 0 <= x1 < self.width and
+                0 <= y0 < self.height and 0 <= y1 < self.height):
+            raise Error("coordinates out of range")
+
+
+    def crop(self, int x0, int y0, int x1, int y1):
+        """returns a new image of the pixels from (x0, y0) up to but not
+        including (x1, y1), clipped to this image"""
+        x0, x1 = (min(max(0, x), self.width) for x in (x0, x1))
+        y0, y1 = (min(max(0, y), self.height) for y in (y0, y1))
+        cdef int width = max(0, x1 - x0)
+        cdef int height = max(0, y1 - y0)
+        if not (width and height):
+            return self.create(width, height)
+        return self.from_data(width, numpy.asarray(self.pixels).reshape(
+                self.height, self.width)[y0:y1, x0:x1].ravel().copy())
+
+
+    def blit(self, source, int x, int y, mode="over"):
+        """draws the source image onto this one with the source's
+        top-left corner at (x, y) (which may be outside this image);
+        whatever falls outside this image is clipped
+
+        mode "over" composites the source over this image using the
+        source's (straight, i.e., not premultiplied) alpha (Porter-Duff
+        over) in a single loop with the GIL released; "copy" replaces
+        this image's pixels with the source's."""
+        if mode not in {"over", "copy"}:
+            raise Error("invalid blit mode '{}'; use over or copy".format(
+                    mode))
+        cdef int x0 = max(0, x)
+        cdef int y0 = max(0, y)
+        cdef int x1 = min(self.width, x + source.width)
+        cdef int y1 = min(self.height, y + source.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        sourcePixels = numpy.asarray(source.pixels).reshape(source.height,
+                source.width)[y0 - y:y1 - y, x0 - x:x1 - x]
+        if source is self: # The regions may overlap
+            sourcePixels = sourcePixels.copy()
+        if mode == "copy":
+            numpy.asarray(self.pixels).reshape(self.height, self.width)[
+                    y0:y1, x0:x1] = sourcePixels
+        else:
+            _blit_over(sourcePixels, self.pixels, self.width, x0, y0)
 
 
     def subsample(self, int stride):
@@ -278,20 +292,21 @@ class Image:
         return self.from_data(self.width // stride, pixels)
 
 
-    def scale(self, double ratio):
+    def scale(self, double ratio, int workers=1):
         """returns a smoothly scaled copy of this image
 
         ratio is how much to scale by, e.g., 0.75 means reduce width and
         height to ¾ their original size, 0.5 to half (making the image ¼
         of the original size), and so on.
 
-        Scaling produces good results even for text.
+        Scaling produces good results even for text. If workers > 1 the
+        rows are scaled in parallel by that many threads.
         """
         assert 0 < ratio < 1
         cdef int columns
         cdef _DTYPE_t[:] pixels
-        columns, pixels = Scale.scale(self.pixels, self.width, self.height,
-                ratio)
+        columns, pixels = scale_fast(self.pixels, self.width, self.height,
+                ratio, workers)
         return self.from_data(columns, pixels)
 
 
@@ -325,3 +340,179 @@ class Image:
 
 _loadForSuffix = {".xbm": Xbm.load, ".xpm": Xpm.load,}
 _saveForSuffix = {".xbm": Xbm.save, ".xpm": Xpm.save,}
+
+
+cdef inline long long _color_or_none(color):
+    return _NO_COLOR if color is None else color
+
+
+# Bresenham's mid-point line scanning algorithm from 
+# http://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _line(_DTYPE_t[:] pixels, int width, int x0, int y0, int x1,
+        int y1, _DTYPE_t color) noexcept nogil:
+    cdef int dx = abs(x1 - x0)
+    cdef int dy = abs(y1 - y0)
+    cdef int xInc = 1 if x0 < x1 else -1
+    cdef int yInc = 1 if y0 < y1 else -1
+    cdef int err = dx - dy
+    cdef int err2
+    while True:
+        pixels[(y0 * width) + x0] = color
+        if x0 == x1 and y0 == y1:
+            break
+        err2 = 2 * err
+        if err2 > -dy:
+            err -= dy
+            x0 += xInc
+        if err2 < dx:
+            err += dx
+            y0 += yInc
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _rectangle(_DTYPE_t[:] pixels, int width, int x0, int y0,
+        int x1, int y1, long long outline,
+        long long fill) noexcept nogil:
+    cdef int y
+    if fill != _NO_COLOR:
+        if y0 > y1:
+            y0, y1 = y1, y0
+        if outline != _NO_COLOR: # no point drawing over the outline
+            x0 += 1
+            x1 -= 1
+            y0 += 1
+            y1 -= 1
+        for y in range(y0, y1 + 1):
+            _line(pixels, width, x0, y, x1, y, <_DTYPE_t>fill)
+    if outline != _NO_COLOR:
+        _line(pixels, width, x0, y0, x1, y0, <_DTYPE_t>outline)
+        _line(pixels, width, x1, y0, x1, y1, <_DTYPE_t>outline)
+        _line(pixels, width, x1, y1, x0, y1, <_DTYPE_t>outline)
+        _line(pixels, width, x0, y1, x0, y0, <_DTYPE_t>outline)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _ellipse(_DTYPE_t[:] pixels, int width, int height, int x0,
+        int y0, int x1, int y1, long long outline,
+        long long fill) noexcept nogil:
+    cdef int halfWidth, halfHeight, midX, midY, x, y
+    cdef double dx, dy, a, b, a2, b2, p
+    if x0 > x1:
+        x0, x1 = x1, x0
+    if y0 > y1:
+        y0, y1 = y1, y0
+    if fill != _NO_COLOR:
+        # Algorithm based on
+        # http://stackoverflow.com/questions/10322341/
+        # simple-algorithm-for-drawing-filled-ellipse-in-c-c
+        # (A filled ellipse less than 2 pixels wide or high is empty)
+        halfWidth = (x1 - x0) // 2
+        halfHeight = (y1 - y0) // 2
+        midX = x0 + halfWidth
+        midY = y0 + halfHeight
+        if halfWidth and halfHeight:
+            for y in range(-halfHeight, halfHeight + 1):
+                for x in range(-halfWidth, halfWidth + 1):
+                    dx = <double>x / halfWidth
+                    dy = <double>y / halfHeight
+                    if ((dx * dx) + (dy * dy)) <= 1:
+                        pixels[((midY + y) * width) + midX + x] = (
+                                <_DTYPE_t>fill)
+    if outline != _NO_COLOR:
+        # Midpoint ellipse algorithm from "Computer Graphics Principles
+        # and Practice".
+        midX = ((x1 - x0) // 2) + x0
+        midY = ((y1 - y0) // 2) + y0
+        a = (x1 - x0) / 2.0
+        b = (y1 - y0) / 2.0
+        a2 = a * a
+        b2 = b * b
+        dx = 0
+        dy = b
+        p = b2 - (a2 * b) + (a2 / 4)
+        _ellipse_points(pixels, width, height, midX, midY, dx, dy,
+                <_DTYPE_t>outline)
+        while (a2 * (dy - 0.5)) > (b2 * (dx + 1)):
+            if p < 0:
+                p += b2 * ((2 * dx) + 3)
+                dx += 1
+            else:
+                p += (b2 * ((2 * dx) + 3)) + (a2 * ((-2 * dy) + 2))
+                dx += 1
+                dy -= 1
+            _ellipse_points(pixels, width, height, midX, midY, dx, dy,
+                    <_DTYPE_t>outline)
+        p = ((b2 * ((dx + 0.5) * (dx + 0.5))) +
+             (a2 * ((dy - 1) * (dy - 1))) - (a2 * b2))
+        while dy > 0:
+            if p < 0:
+                p += (b2 * ((2 * dx) + 2)) + (a2 * ((-2 * dy) + 3))
+                dx += 1
+                dy -= 1
+            else:
+                p += a2 * ((-2 * dy) + 3)
+                dy -= 1
+            _ellipse_points(pixels, width, height, midX, midY, dx, dy,
+                    <_DTYPE_t>outline)
+
+
+cdef inline void _ellipse_points(_DTYPE_t[:] pixels, int width,
+        int height, int midX, int midY, double dx, double dy,
+        _DTYPE_t color) noexcept nogil:
+    # dx is always a whole number; dy may not be
+    cdef int x = <int>dx
+    cdef int top = <int>round(midY - dy)
+    cdef int bottom = <int>round(midY + dy)
+    _clipped_pixel(pixels, width, height, midX + x, bottom, color)
+    _clipped_pixel(pixels, width, height, midX - x, top, color)
+    _clipped_pixel(pixels, width, height, midX + x, top, color)
+    _clipped_pixel(pixels, width, height, midX - x, bottom, color)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _blit_over(_DTYPE_t[:, :] source, _DTYPE_t[:] pixels,
+        int width, int x0, int y0):
+    cdef Py_ssize_t row, column, index
+    with nogil:
+        for row in range(source.shape[0]):
+            index = ((y0 + row) * width) + x0
+            for column in range(source.shape[1]):
+                pixels[index + column] = _over_color(source[row, column],
+                        pixels[index + column])
+
+
+@cython.cdivision(True)
+cdef inline _DTYPE_t _over_color(_DTYPE_t color,
+        _DTYPE_t pixel) noexcept nogil:
+    # The same integer arithmetic as Image's _over() so the results are
+    # identical
+    cdef long long alpha = color >> 24
+    if alpha == 0:
+        return pixel
+    if alpha == _MAX_COMPONENT:
+        return color
+    cdef long long weight = (pixel >> 24) * (_MAX_COMPONENT - alpha)
+    cdef long long total = (alpha * _MAX_COMPONENT) + weight
+    cdef _DTYPE_t value = <_DTYPE_t>(((total + (_MAX_COMPONENT // 2)) //
+            _MAX_COMPONENT) << 24)
+    cdef int shift
+    for shift in range(16, -1, -8): # Red, green, blue
+        value |= <_DTYPE_t>(((((color >> shift) & _MAX_COMPONENT) * alpha *
+                _MAX_COMPONENT) + (((pixel >> shift) & _MAX_COMPONENT) *
+                weight) + (total // 2)) // total) << shift
+    return value
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _clipped_pixel(_DTYPE_t[:] pixels, int width, int height,
+        int x, int y, _DTYPE_t color) noexcept nogil:
+    # Rounding can put an outline point just outside the ellipse's box
+    if 0 <= x < width and 0 <= y < height:
+        pixels[(y * width) + x] = color
@@ -13,6 +13,7 @@ import io
 import mmap
 import os
 import warnings
+import numpy
 cimport numpy
 from cyImage.Globals import *
 
@@ -10,4 +10,5 @@
 # General Public License for more details.
 
 from cyImage.cyImage.Image import (Error, Image, argb_for_color,
-        rgb_for_color, color_for_argb, color_for_rgb, color_for_name)
+        rgb_for_color, color_for_argb, color_for_rgb, color_for_name,
+        LINE, RECTANGLE, ELLIPSE, NO_COLOR)
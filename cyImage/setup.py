@@ -9,13 +9,22 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
 # General Public License for more details.
 
-# Build with: python3 setup.py build_ext --inplace
 
-import distutils.core
-import numpy
-import Cython.Build
+# Build with: python3 cyImage/setup.py build_ext --inplace
+# (or python3 setup.py build_ext --inplace from inside cyImage/). This
+# also builds Scale.Fast which cyImage's Image.scale() uses; set OPENMP=0
+# to build without OpenMP (see CythonBuild.py)
 
+import os
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT) # For CythonBuild
+import CythonBuild
 
-distutils.core.setup(name="cyImage",
-        include_dirs=[numpy.get_include()],
-        ext_modules=Cython.Build.cythonize("*.pyx"))
+
+# The modules are the cyImage.cyImage ones that cyImage/__init__.py
+# imports, so their directory must exist for build_ext --inplace
+os.makedirs(os.path.join(ROOT, "cyImage", "cyImage"), exist_ok=True)
+CythonBuild.build("cyImage", [CythonBuild.extension("cyImage.cyImage." +
+        name, os.path.join("cyImage", name + ".pyx")) for name in ("Image",
+        "Xbm", "Xpm")] + [CythonBuild.scale_fast()])
@@ -19,18 +19,29 @@ import concurrent.futures
 import math
 import multiprocessing
 import os
+import shutil
+import time
 import Image
 import Qtrac
 
 
-Result = collections.namedtuple("Result", "copied scaled name")
-Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
+Result = collections.namedtuple("Result", "copied scaled name fingerprint")
+Chunk = collections.namedtuple("Chunk", "results errors seconds")
+Summary = collections.namedtuple("Summary",
+        "todo copied scaled canceled unchanged")
+MANIFEST = ".imagescale.json"
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    (size, smooth, source, target, concurrency, cache, manifest,
+     maxPending) = handle_commandline()
     Qtrac.report("starting...")
-    summary = scale(size, smooth, source, target, concurrency)
+    summary = scale(size, smooth, source, target, concurrency, cache,
+            manifest, maxPending)
+    if cache is not None:
+        cache.save()  # remember the sizes for next time
+    if manifest is not None:
+        manifest.save()  # remember what was made, even if canceled
     summarize(summary, concurrency)
 
 
@@ -40,77 +51,166 @@ def handle_commandline():
             default=multiprocessing.cpu_count(),
             help="specify the concurrency (for debugging and "
                 "timing) [default: %(default)d]")
+    parser.add_argument("-p", "--max-pending", type=int,
+            help="the most chunks of jobs to have submitted but "
+                "unfinished at once [default: 4 x concurrency]")
     parser.add_argument("-s", "--size", default=400, type=int,
             help="make a scaled image that fits the given dimension "
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-m", "--metacache",
+            help="a file for caching image sizes between runs so that "
+                "unchanged images needn't even have their headers read")
+    parser.add_argument("-i", "--incremental", action="store_true",
+            help="skip sources that are unchanged since an earlier "
+                "incremental run made their targets (recorded in the "
+                "target's {} manifest)".format(MANIFEST))
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
             help="the directory for the scaled .xpm images")
     args = parser.parse_args()
+    if args.max_pending is not None and args.max_pending < 1:
+        parser.error("--max-pending must be at least 1")
     source = os.path.abspath(args.source)
     target = os.path.abspath(args.target)
     if source == target:
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target, args.concurrency
-
-
-def scale(size, smooth, source, target, concurrency):
-    futures = set()  # data structure set() like tuple, disordered, non-slicing
+    cache = (Image.ProbeCache(args.metacache) if args.metacache else
+             None)
+    manifest = (Qtrac.Manifest(os.path.join(target, MANIFEST),
+                dict(size=args.size, smooth=args.smooth))
+                if args.incremental else None)
+    maxPending = args.max_pending or 4 * args.concurrency
+    return (args.size, args.smooth, source, target, args.concurrency, cache,
+            manifest, maxPending)
+
+
+def scale(size, smooth, source, target, concurrency, cache, manifest,
+        maxPending):
+    todo = 0
+    canceled = False
+    counts = collections.Counter()  # copied, scaled and unchanged
+    # Jobs are submitted in chunks (each processed by one worker call)
+    # whose size adapts to how long the jobs take so that many small
+    # images don't each pay for a round trip to a worker process
+    sizer = Qtrac.ChunkSizer()
+    # At most maxPending futures (and their pickled arguments) exist at
+    # once so memory use doesn't grow with the number of files, and
+    # results are reported as soon as the window has filled
+    futures = set()
     with concurrent.futures.ProcessPoolExecutor(  # process pool executor used for CPU intensive computing concurrency
-            max_workers=concurrency) as executor:  # make processes!
-        for sourceImage, targetImage in get_jobs(source, target):  # get_jobs returns a generator of paths of images
-            future = executor.submit(scale_one, size, smooth, sourceImage,
-                    targetImage)  # submit(fn, *args, **kwargs) returns a future instance: future.running(), future.done
-            futures.add(future)  # add future instance into futures set(): run the process if future instance in pool
-        summary = wait_for(futures)  # future's wait() returns a tuple(set(completed), set(uncompleted)). Not wait_for
-        if summary.canceled:  # if there is no this "if" here, executor will be shutdown as well for the "with" above.
+            max_workers=concurrency,
+            initializer=Qtrac.ignore_interrupts) as executor:  # make processes!
+        try:
+            jobs = get_jobs(source, target, cache, manifest, counts)  # get_jobs returns a generator of paths of images
+            for chunk in sizer.chunks(jobs):
+                if len(futures) >= maxPending:  # wait for room in the window
+                    done, _ = concurrent.futures.wait(futures,
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+                    wait_for(done, futures, counts, source, manifest,
+                            sizer)
+                futures.add(executor.submit(scale_chunk, size, smooth,
+                        chunk, manifest is not None))  # submit(fn, *args, **kwargs) returns a future instance: future.running(), future.done
+                todo += len(chunk)
+            wait_for(concurrent.futures.as_completed(futures), futures,
+                    counts, source, manifest, sizer)  # block main process, wait for all sub processes done
+        except KeyboardInterrupt:  # receive ctl+c to abort processing during running this py
+            Qtrac.report("canceling...")
+            canceled = True
+            for future in futures:
+                future.cancel()  # cancel rest of the future instances: sub processes will not run these canceled instances
             executor.shutdown()  # shutdown all sub processes
-        return summary
-# if we caught the KeyboardInterrupt in this function we'd lose the
-# accumulated todo, copied, scaled counts.
-
-
-def get_jobs(source, target):
-    for name in os.listdir(source):  # listdir: make a list of all file names in source path
-        yield os.path.join(source, name), os.path.join(target, name)  # such as c:/source/images/1
-
-
-def wait_for(futures):
-    canceled = False
-    copied = scaled = 0
-    try:
-        for future in concurrent.futures.as_completed(futures):  # block main process, wait for all sub processes done
-            # as completed(futures, timeout=) returns a iterator: wait for each process done in timeout (block)
-            err = future.exception()
-            if err is None:
-                result = future.result()
-                copied += result.copied
-                scaled += result.scaled
-                Qtrac.report("{} {}".format("copied" if result.copied else
-                        "scaled", os.path.basename(result.name)))
-            elif isinstance(err, Image.Error):  # image file error
-                Qtrac.report(str(err), True)
-            else:
-                raise err # Unanticipated
-    except KeyboardInterrupt:  # receive ctl+c to abort processing during running this py
-        Qtrac.report("canceling...")
-        canceled = True
-        for future in futures:
-            future.cancel()  # cancel rest of the future instances: sub processes will not run these canceled instances
-    return Summary(len(futures), copied, scaled, canceled)  # canceled = True
-
-
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
-    if oldImage.width <= size and oldImage.height <= size:
-        oldImage.save(targetImage)
-        return Result(1, 0, targetImage)
+            # The chunks that had started (or finished but weren't yet
+            # waited for) have written their files so must be counted
+            wait_for([future for future in futures if not
+                    future.cancelled() and future.exception() is None],
+                    futures, counts, source, manifest, sizer)
+    return Summary(todo, counts["copied"], counts["scaled"], canceled,
+            counts["unchanged"])
+
+
+def get_jobs(source, target, cache, manifest, counts):
+    # scandir() streams the directory rather than listing it all first
+    with os.scandir(source) as entries:
+        for entry in entries:
+            sourceImage = entry.path
+            targetImage = os.path.join(target, entry.name)  # such as c:/source/images/1
+            if manifest is not None and manifest.up_to_date(sourceImage,
+                    targetImage):
+                counts["unchanged"] += 1  # skipped without even reading its header
+                continue
+            yield sourceImage, targetImage, probe(cache, sourceImage)
+
+
+def probe(cache, sourceImage):
+    if cache is not None:
+        try:
+            return cache.probe(sourceImage)  # (width, height)
+        except (Image.Error, OSError):
+            pass  # scale_chunk() will report the problem
+    return None
+
+
+def wait_for(done, futures, counts, source, manifest, sizer):
+    # Each future in done is removed from futures once its results are
+    # accounted for; they're reported afterwards since that's slow and so
+    # is where a Ctrl+C usually lands
+    for future in done:
+        chunk = future.result()  # Unanticipated errors are raised here
+        for result in chunk.results:
+            counts["copied"] += result.copied
+            counts["scaled"] += result.scaled
+            if manifest is not None:
+                manifest.record(os.path.join(source, os.path.basename(
+                        result.name)), result.name, result.fingerprint)
+        futures.discard(future)
+        sizer.observe(len(chunk.results) + len(chunk.errors),
+                chunk.seconds)
+        for result in chunk.results:
+            Qtrac.report("{} {}".format("copied" if result.copied else
+                    "scaled", os.path.basename(result.name)))
+        for error in chunk.errors:  # image file errors
+            Qtrac.report(error, True)
+
+
+def scale_chunk(size, smooth, jobs, incremental):
+    results = []
+    errors = []
+    start = time.perf_counter()
+    for sourceImage, targetImage, dimensions in jobs:
+        try:
+            results.append(scale_one(size, smooth, sourceImage,
+                    targetImage, dimensions, incremental))
+        except Image.Error as err:
+            errors.append(str(err))
+    return Chunk(results, errors, time.perf_counter() - start)
+
+
+def scale_one(size, smooth, sourceImage, targetImage, dimensions=None,
+        incremental=False):
+    # Only the header is read to decide whether the image is small
+    # enough to copy: the pixels are only decoded if it needs scaling.
+    # If incremental the source is read once, and the target is made
+    # from, and the manifest given the Fingerprint of, exactly that data
+    data = fingerprint = None
+    if incremental:
+        data, fingerprint = Qtrac.read_fingerprinted(sourceImage)
+    width, height = (dimensions if dimensions is not None else
+                     Image.probe(sourceImage))
+    if width <= size and height <= size:
+        if data is None:
+            shutil.copyfile(sourceImage, targetImage)
+        else:
+            with open(targetImage, "wb") as file:
+                file.write(data)
+        return Result(1, 0, targetImage, fingerprint)
     else:
+        oldImage = (Image.from_file(sourceImage) if data is None else
+                    Image.from_bytes(data, sourceImage))
         if smooth:
             scale = min(size / oldImage.width, size / oldImage.height)
             newImage = oldImage.scale(scale)
@@ -119,7 +219,7 @@ def scale_one(size, smooth, sourceImage, targetImage):
                                        oldImage.height / size)))
             newImage = oldImage.subsample(stride)
         newImage.save(targetImage)
-        return Result(0, 1, targetImage)
+        return Result(0, 1, targetImage, fingerprint)
 
 
 def summarize(summary, concurrency):
@@ -127,6 +227,8 @@ def summarize(summary, concurrency):
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if summary.unchanged:
+        message += "unchanged {} ".format(summary.unchanged)
     message += "using {} processes".format(concurrency)
     if summary.canceled:
         message += " [canceled]"
@@ -19,14 +19,19 @@ import Image
 import Qtrac
 
 
-Result = collections.namedtuple("Result", "copied scaled name")  # copied:0or1 scaled:0or1
-Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
+Result = collections.namedtuple("Result", "copied scaled name fingerprint")  # copied:0or1 scaled:0or1
+Summary = collections.namedtuple("Summary",
+        "todo copied scaled canceled unchanged")
+MANIFEST = ".imagescale.json"
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    size, smooth, source, target, concurrency, manifest = (
+            handle_commandline())
     Qtrac.report("starting...")  # just output the first 70th's log words
-    summary = scale(size, smooth, source, target, concurrency)  # return Summary
+    summary = scale(size, smooth, source, target, concurrency, manifest)  # return Summary
+    if manifest is not None:
+        manifest.save()
     summarize(summary, concurrency)
 
 
@@ -41,6 +46,10 @@ def handle_commandline():
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",   # "true" value is stored for this parameter
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+            help="skip sources that are unchanged since an earlier "
+                "incremental run made their targets (recorded in the "
+                "target's {} manifest)".format(MANIFEST))
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -52,66 +61,98 @@ def handle_commandline():
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)  # makedirs: make dirS if they don't exist
-    return args.size, args.smooth, source, target, args.concurrency
+    manifest = (Qtrac.Manifest(os.path.join(target, MANIFEST),
+                dict(size=args.size, smooth=args.smooth))
+                if args.incremental else None)
+    return (args.size, args.smooth, source, target, args.concurrency,
+            manifest)
 
 
-def scale(size, smooth, source, target, concurrency):
+def scale(size, smooth, source, target, concurrency, manifest):
     canceled = False
     jobs = multiprocessing.JoinableQueue()  # make jobs queue: like Queue() but join() and task_done() added
     results = multiprocessing.Queue()  # make results queue: filled in worker()
-    create_processes(size, smooth, jobs, results, concurrency)  # Process in for -> daemon -> start()
-    todo = add_jobs(source, target, jobs)  # fill jobs queue with source and target and return source images' names list
+    create_processes(size, smooth, manifest is not None, jobs, results,
+            concurrency)  # Process in for -> daemon -> start()
+    todo, unchanged = add_jobs(source, target, jobs, manifest)  # fill jobs queue with source and target and return source images' names list
     try:        # queue.put() -> queue.task_done() in for -> queue.join()
         jobs.join()  # block main process until jobs queue is empty
     except KeyboardInterrupt:  # May not work on Windows
         Qtrac.report("canceling...")
         canceled = True
     copied = scaled = 0
-    while not results.empty():  # queue results is filled in each worker() process
-        result = results.get_nowait()  # Remove and return an item from the queue without blocking
+    # Each job puts exactly one result (None if it failed), so they are
+    # counted: results.empty() can be True while a worker's last result
+    # is still on its way
+    for _ in range(todo):
+        if canceled and results.empty():
+            break  # the jobs that weren't done put no results
+        result = results.get()  # queue results is filled in each worker() process
+        if result is None:
+            continue
         copied += result.copied
         scaled += result.scaled
-    return Summary(todo, copied, scaled, canceled)  # copied: the total number of copied images
+        if manifest is not None:
+            manifest.record(os.path.join(source, os.path.basename(
+                    result.name)), result.name, result.fingerprint)
+    return Summary(todo, copied, scaled, canceled, unchanged)  # copied: the total number of copied images
 
 
-def create_processes(size, smooth, jobs, results, concurrency):
+def create_processes(size, smooth, incremental, jobs, results,
+        concurrency):
     for _ in range(concurrency):
         process = multiprocessing.Process(target=worker, args=(size,
-                smooth, jobs, results))
+                smooth, incremental, jobs, results))
         process.daemon = True  # All multiprocess are done when main process is done
         process.start()  # prepare multiprocess and call run()
         # here the process is blocked, not running, because worker's jobs queue is empty.
         # It needs to add_jobs(): jobs.put() to run() this process
 
 
-def worker(size, smooth, jobs, results):
+def worker(size, smooth, incremental, jobs, results):
     while True:  # infinite loop is to finished when main process ends. (Daemon = True)
         try:
             sourceImage, targetImage = jobs.get()  # get images from queue. Blocked if no images to get.
+            result = None  # what's put if the job fails
             try:
-                result = scale_one(size, smooth, sourceImage, targetImage)  # return Result
+                result = scale_one(size, smooth, sourceImage, targetImage,
+                        incremental)  # return Result
                 Qtrac.report("{} {}".format("copied" if result.copied else
                         "scaled", os.path.basename(result.name)))
-                results.put(result)  # put the result(Result) into the results queue
             except Image.Error as err:
                 Qtrac.report(str(err), True)  # True: it is an error
+            finally:
+                results.put(result)  # put the result(Result) into the results queue
         finally:
             jobs.task_done()  # this job is done. One task is done.
 
 
-def add_jobs(source, target, jobs):
-    for todo, name in enumerate(os.listdir(source), start=1):  # listdir: make a list of all file names in source path
+def add_jobs(source, target, jobs, manifest):
+    todo = unchanged = 0
+    for name in os.listdir(source):  # listdir: make a list of all file names in source path
         sourceImage = os.path.join(source, name)    # c:/source/images/1
         targetImage = os.path.join(target, name)    # c:/target/images/1
+        if manifest is not None and manifest.up_to_date(sourceImage,
+                targetImage):
+            unchanged += 1  # skipped without being read at all
+            continue
         jobs.put((sourceImage, targetImage))  # put the job into the jobs queue
-    return todo  # the list of all file names in source path
+        todo += 1
+    return todo, unchanged  # how many jobs were queued and skipped
 
 
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)  # load source image
+def scale_one(size, smooth, sourceImage, targetImage, incremental=False):
+    # If incremental the source is read once, and the target is made
+    # from, and the manifest given the Fingerprint of, exactly that data
+    if incremental:
+        data, fingerprint = Qtrac.read_fingerprinted(sourceImage)
+        oldImage = Image.from_bytes(data, sourceImage)
+    else:
+        oldImage = Image.from_file(sourceImage)  # load source image
+        fingerprint = None
     if oldImage.width <= size and oldImage.height <= size:  # size: specified width and height, default values: 400, 400
         oldImage.save(targetImage)  # save it as target filename
-        return Result(1, 0, targetImage)  # 1: copied  0: scaled
+        return Result(1, 0, targetImage, fingerprint)  # 1: copied  0: scaled
     else:
         if smooth:
             scale = min(size / oldImage.width, size / oldImage.height)  # 0 < scale < 1
@@ -121,7 +162,7 @@ def scale_one(size, smooth, sourceImage, targetImage):
                                        oldImage.height / size)))  # ceil refer to hands-on note
             newImage = oldImage.subsample(stride)  # make the new image size into 1/stride
         newImage.save(targetImage)
-        return Result(0, 1, targetImage)  # 0: copied   1: scaled
+        return Result(0, 1, targetImage, fingerprint)  # 0: copied   1: scaled
 
 
 def summarize(summary, concurrency):
@@ -129,6 +170,8 @@ def summarize(summary, concurrency):
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if summary.unchanged:
+        message += "unchanged {} ".format(summary.unchanged)
     message += "using {} processes".format(concurrency)
     if summary.canceled:
         message += " [canceled]"
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Copyright © 2012-13 Qtrac Ltd. All rights reserved.
+# This program or module is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version. It is provided for
+# educational purposes and is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+
+# A staged pipeline: a pool of reader threads reads each source file's
+# bytes, a pool of processes decodes, scales, and encodes them in memory,
+# and a pool of writer threads writes the results. Each stage has its own
+# concurrency and the stages are joined by bounded queues, so the CPUs
+# are kept busy while slow (e.g., network) storage is read or written,
+# yet only a bounded number of images is ever held in memory. The image
+# data goes to and from the processes in shared memory (see
+# Image.share_file()) so only small descriptors are pickled.
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import Image
+import Qtrac
+
+
+Result = collections.namedtuple("Result", "copied scaled data")
+Summary = collections.namedtuple("Summary",
+        "todo copied scaled canceled unchanged")
+MANIFEST = ".imagescale.json"
+
+
+def main():
+    args, manifest = handle_commandline()
+    Qtrac.report("starting...")
+    summary = scale(args, manifest)
+    if manifest is not None:
+        manifest.save()
+    summarize(summary, args)
+
+
+def handle_commandline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", type=int,
+            default=multiprocessing.cpu_count(),
+            help="how many processes decode, scale, and encode "
+                "[default: %(default)d]")
+    parser.add_argument("-r", "--readers", type=int, default=4,
+            help="how many threads read the source files "
+                "[default: %(default)d]")
+    parser.add_argument("-w", "--writers", type=int, default=4,
+            help="how many threads write the target files "
+                "[default: %(default)d]")
+    parser.add_argument("-p", "--max-pending", type=int,
+            help="how many images each queue between the stages may "
+                "hold [default: 4 x concurrency]")
+    parser.add_argument("-s", "--size", default=400, type=int,
+            help="make a scaled image that fits the given dimension "
+                "[default: %(default)d]")
+    parser.add_argument("-S", "--smooth", action="store_true",
+            help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+            help="skip sources that are unchanged since an earlier "
+                "incremental run made their targets (recorded in the "
+                "target's {} manifest)".format(MANIFEST))
+    parser.add_argument("source",
+            help="the directory containing the original .xpm images")
+    parser.add_argument("target",
+            help="the directory for the scaled .xpm images")
+    args = parser.parse_args()
+    if min(args.concurrency, args.readers, args.writers,
+            args.max_pending or 1) < 1:
+        parser.error("the concurrencies and --max-pending must be at "
+                "least 1")
+    args.max_pending = args.max_pending or 4 * args.concurrency
+    args.source = os.path.abspath(args.source)
+    args.target = os.path.abspath(args.target)
+    if args.source == args.target:
+        parser.error("source and target must be different")
+    if not os.path.exists(args.target):
+        os.makedirs(args.target)
+    manifest = (Qtrac.Manifest(os.path.join(args.target, MANIFEST),
+                dict(size=args.size, smooth=args.smooth))
+                if args.incremental else None)
+    return args, manifest
+
+
+class Stage:
+
+    def __init__(self, count, size, function, *args, lock):
+        """A pool of count threads that call function(*args, *item) for
+        each item put() on the stage's queue, which holds at most size
+        items; put() blocks while it is full
+
+        An unexpected exception from function is reported (holding lock)
+        and the thread goes on to the next item, so that the queue is
+        always served and stop() can't block."""
+        self.queue = queue.Queue(size)
+        self.lock = lock
+        self.stopping = 0
+        # Set by each thread as it finishes; stop() waits for these rather
+        # than join()ing since a Ctrl+C that interrupts Thread.join() can
+        # leave the thread marked as stopped while it is still running
+        self.finished = [threading.Event() for _ in range(count)]
+        for finished in self.finished:
+            threading.Thread(target=self._run, args=(function, args,
+                    finished), daemon=True).start()
+
+
+    def _run(self, function, args, finished):
+        try:
+            for item in iter(self.queue.get, None):
+                try:
+                    function(*(args + item))
+                except Exception as err:
+                    report(self.lock, "unexpected error for {}: {}".format(
+                            os.path.basename(item[0]), err), True)
+        finally:
+            finished.set()
+
+
+    def put(self, *item):
+        self.queue.put(item)
+
+
+    def stop(self):
+        """waits for every item put so far to be processed and for the
+        threads to finish; it is safe to call this again if it was
+        interrupted"""
+        while self.stopping < len(self.finished):
+            self.queue.put(None) # Each thread finishes on getting a None
+            self.stopping += 1
+        for finished in self.finished:
+            finished.wait()
+
+
+def scale(args, manifest):
+    todo = unchanged = 0
+    counts = collections.Counter()  # copied and scaled
+    lock = threading.Lock()  # serializes counting, reporting, and recording
+    canceled = threading.Event()
+    # The processes ignore Ctrl+C so that only this one cancels, and so
+    # releases every job's shared memory
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.concurrency, mp_context=process_context(),
+            initializer=Qtrac.ignore_interrupts) as executor:
+        writers = Stage(args.writers, args.max_pending, write, counts,
+                lock, manifest, canceled, lock=lock)
+        readers = Stage(args.readers, args.max_pending, read, args.size,
+                args.smooth, executor, writers, lock, canceled, lock=lock)
+        try:
+            start_processes(executor, args.concurrency)
+            for sourceImage, targetImage in get_jobs(args.source,
+                    args.target):
+                if manifest is not None and manifest.up_to_date(
+                        sourceImage, targetImage):
+                    unchanged += 1
+                    continue
+                readers.put(sourceImage, targetImage)
+                todo += 1
+            readers.stop()
+            writers.stop()
+        except KeyboardInterrupt:
+            report(lock, "canceling...")
+            canceled.set()
+            readers.stop() # The threads skip whatever is left
+            writers.stop()
+    return Summary(todo, counts["copied"], counts["scaled"],
+            canceled.is_set(), unchanged)
+
+
+def process_context():
+    # Forking a process that has other threads can leave the child
+    # deadlocked on a lock that one of them held, so the pool's processes
+    # are started by a forkserver (or spawned where there is no
+    # forkserver, e.g., on Windows) rather than forked. The forkserver
+    # imports Image (and so numpy) once for all of the processes.
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["Image"])
+    return context
+
+
+def start_processes(executor, concurrency):
+    # The pool only starts a process when a job is submitted, so submits
+    # a do-nothing job per process now, from the main thread, rather than
+    # leaving them to be started by the reader threads' first jobs
+    for future in [executor.submit(int) for _ in range(concurrency)]:
+        future.result()
+
+
+def get_jobs(source, target):
+    with os.scandir(source) as entries:
+        for entry in entries:
+            yield entry.path, os.path.join(target, entry.name)
+
+
+def read(size, smooth, executor, writers, lock, canceled, sourceImage,
+        targetImage):
+    if canceled.is_set():
+        return
+    try: # The file is read straight into shared memory
+        stat = os.stat(sourceImage) # Before reading, for the manifest
+        shared = Image.share_file(sourceImage)
+    except OSError as err:
+        report(lock, str(err), True)
+        return
+    future = None
+    try: # The shared memory is ours to release until a writer has the job
+        future = executor.submit(scale_one, size, smooth,
+                os.path.basename(sourceImage), shared)
+        writers.put(sourceImage, targetImage, stat, shared, future)
+    except Exception as err: # e.g., the pool is broken by a Ctrl+C
+        discard(shared, future)
+        if not canceled.is_set():
+            report(lock, str(err), True)
+    except BaseException:
+        discard(shared, future)
+        raise
+
+
+def write(counts, lock, manifest, canceled, sourceImage, targetImage, stat,
+        shared, future):
+    # The writer owns both of the job's shared memory blocks (the source's
+    # and, if scaled, the result's) and must release them whatever happens
+    if canceled.is_set():
+        discard(shared, future)
+        return
+    try:
+        result = future.result()
+        with Image.shared_view(shared) as data:
+            if result.copied:
+                write_file(targetImage, data)
+            else:
+                with Image.shared_view(result.data) as output:
+                    write_file(targetImage, output)
+            if manifest is not None:
+                fingerprint = Qtrac.fingerprint(data, stat)
+                with lock:
+                    manifest.record(sourceImage, targetImage, fingerprint)
+    except (Image.Error, OSError) as err:
+        release(shared, future)
+        report(lock, str(err), True)
+        return
+    except (Exception, KeyboardInterrupt) as err: # e.g., from a Ctrl+C
+        release(shared, future)
+        if not canceled.is_set():
+            report(lock, "unexpected error for {}: {}".format(
+                    os.path.basename(sourceImage), err), True)
+        return
+    with lock:
+        counts["copied"] += result.copied
+        counts["scaled"] += result.scaled
+        Qtrac.report("{} {}".format("copied" if result.copied else
+                "scaled", os.path.basename(targetImage)))
+
+
+def write_file(filename, data):
+    with open(filename, "wb") as file:
+        file.write(data)
+
+
+def discard(shared, future):
+    # Releases the job's shared memory now if it wasn't submitted or hadn't
+    # started, otherwise when it has finished
+    if future is None or future.cancel():
+        Image.release_shared(shared)
+    else:
+        future.add_done_callback(functools.partial(release, shared))
+
+
+def release(shared, future):
+    # Releases whichever of the job's shared memory blocks still exist
+    Image.release_shared(shared)
+    if (future.done() and not future.cancelled() and
+            future.exception() is None):
+        Image.release_shared(future.result().data)
+
+
+def report(lock, message, error=False):
+    with lock:
+        Qtrac.report(message, error)
+
+
+def scale_one(size, smooth, name, shared):
+    # Decodes, scales, and encodes in memory. The source's shared memory
+    # is only read (the writer releases it, and for a copy writes it); a
+    # scaled image's data is returned in new shared memory
+    with Image.shared_view(shared, release=False) as data:
+        oldImage = Image.from_bytes(data, name)
+    if oldImage.width <= size and oldImage.height <= size:
+        return Result(1, 0, None)
+    if smooth:
+        scale = min(size / oldImage.width, size / oldImage.height)
+        newImage = oldImage.scale(scale)
+    else:
+        stride = int(math.ceil(max(oldImage.width / size,
+                                   oldImage.height / size)))
+        newImage = oldImage.subsample(stride)
+    return Result(0, 1, Image.share_bytes(newImage.to_bytes(name)))
+
+
+def summarize(summary, args):
+    message = "copied {} scaled {} ".format(summary.copied, summary.scaled)
+    difference = summary.todo - (summary.copied + summary.scaled)
+    if difference:
+        message += "skipped {} ".format(difference)
+    if summary.unchanged:
+        message += "unchanged {} ".format(summary.unchanged)
+    message += "using {} readers, {} processes, {} writers".format(
+            args.readers, args.concurrency, args.writers)
+    if summary.canceled:
+        message += " [canceled]"
+    Qtrac.report(message)
+    print()
+
+
+if __name__ == "__main__":
+    main()
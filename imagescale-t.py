@@ -23,14 +23,19 @@ import Image
 import Qtrac
 
 
-Result = collections.namedtuple("Result", "copied scaled name")
-Summary = collections.namedtuple("Summary", "todo copied scaled canceled")
+Result = collections.namedtuple("Result", "copied scaled name fingerprint")
+Summary = collections.namedtuple("Summary",
+        "todo copied scaled canceled unchanged")
+MANIFEST = ".imagescale.json"
 
 
 def main():
-    size, smooth, source, target, concurrency = handle_commandline()
+    size, smooth, source, target, concurrency, manifest = (
+            handle_commandline())
     Qtrac.report("starting...")
-    summary = scale(size, smooth, source, target, concurrency)
+    summary = scale(size, smooth, source, target, concurrency, manifest)
+    if manifest is not None:
+        manifest.save()
     summarize(summary, concurrency)
 
 
@@ -45,6 +50,10 @@ def handle_commandline():
                 "[default: %(default)d]")
     parser.add_argument("-S", "--smooth", action="store_true",
             help="use smooth scaling (slow but good for text)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+            help="skip sources that are unchanged since an earlier "
+                "incremental run made their targets (recorded in the "
+                "target's {} manifest)".format(MANIFEST))
     parser.add_argument("source",
             help="the directory containing the original .xpm images")
     parser.add_argument("target",
@@ -56,17 +65,26 @@ def handle_commandline():
         args.error("source and target must be different")
     if not os.path.exists(args.target):
         os.makedirs(target)
-    return args.size, args.smooth, source, target, args.concurrency
+    manifest = (Qtrac.Manifest(os.path.join(target, MANIFEST),
+                dict(size=args.size, smooth=args.smooth))
+                if args.incremental else None)
+    return (args.size, args.smooth, source, target, args.concurrency,
+            manifest)
 
 
-def scale(size, smooth, source, target, concurrency):
+def scale(size, smooth, source, target, concurrency, manifest):
+    unchanged = 0
     futures = set()
     with concurrent.futures.ThreadPoolExecutor(
             max_workers=concurrency) as executor:
         for sourceImage, targetImage in get_jobs(source, target):
+            if manifest is not None and manifest.up_to_date(sourceImage,
+                    targetImage):
+                unchanged += 1
+                continue
             futures.add(executor.submit(scale_one, size, smooth,
-                    sourceImage, targetImage))
-        summary = wait_for(futures)
+                    sourceImage, targetImage, manifest is not None))
+        summary = wait_for(futures, source, manifest, unchanged)
         if summary.canceled:
             executor.shutdown()
         return summary
@@ -79,7 +97,7 @@ def get_jobs(source, target):
         yield os.path.join(source, name), os.path.join(target, name)
 
 
-def wait_for(futures):
+def wait_for(futures, source, manifest, unchanged):
     canceled = False
     copied = scaled = 0
     try:
@@ -89,8 +107,12 @@ def wait_for(futures):
                 result = future.result()
                 copied += result.copied
                 scaled += result.scaled
+                name = os.path.basename(result.name)
+                if manifest is not None:
+                    manifest.record(os.path.join(source, name),
+                            result.name, result.fingerprint)
                 Qtrac.report("{} {}".format("copied" if result.copied else
-                        "scaled", os.path.basename(result.name)))
+                        "scaled", name))
             elif isinstance(err, Image.Error):
                 Qtrac.report(str(err), True)
             else:
@@ -100,14 +122,21 @@ def wait_for(futures):
         canceled = True
         for future in futures:
             future.cancel()
-    return Summary(len(futures), copied, scaled, canceled)
+    return Summary(len(futures), copied, scaled, canceled, unchanged)
 
 
-def scale_one(size, smooth, sourceImage, targetImage):
-    oldImage = Image.from_file(sourceImage)
+def scale_one(size, smooth, sourceImage, targetImage, incremental=False):
+    # If incremental the source is read once, and the target is made
+    # from, and the manifest given the Fingerprint of, exactly that data
+    if incremental:
+        data, fingerprint = Qtrac.read_fingerprinted(sourceImage)
+        oldImage = Image.from_bytes(data, sourceImage)
+    else:
+        oldImage = Image.from_file(sourceImage)
+        fingerprint = None
     if oldImage.width <= size and oldImage.height <= size:
         oldImage.save(targetImage)
-        return Result(1, 0, targetImage)
+        return Result(1, 0, targetImage, fingerprint)
     else:
         if smooth:
             scale = min(size / oldImage.width, size / oldImage.height)
@@ -117,7 +146,7 @@ def scale_one(size, smooth, sourceImage, targetImage):
                                        oldImage.height / size)))
             newImage = oldImage.subsample(stride)
         newImage.save(targetImage)
-        return Result(0, 1, targetImage)
+        return Result(0, 1, targetImage, fingerprint)
 
 
 def summarize(summary, concurrency):
@@ -125,6 +154,8 @@ def summarize(summary, concurrency):
     difference = summary.todo - (summary.copied + summary.scaled)
     if difference:
         message += "skipped {} ".format(difference)
+    if summary.unchanged:
+        message += "unchanged {} ".format(summary.unchanged)
     message += "using {} threads".format(concurrency)
     if summary.canceled:
         message += " [canceled]"
@@ -12,6 +12,8 @@
 ABOUT = "About"
 APPNAME = "ImageScale"
 GENERAL = "General"
+INCREMENTAL = "Incremental"
+MANIFEST = ".imagescale.json"
 PAD = "0.75m"
 POSITION = "position"
 RESTORE = "Restore"
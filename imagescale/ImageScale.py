@@ -14,25 +14,39 @@ import concurrent.futures
 import multiprocessing
 import os
 import sys
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
         ".."))) # For access to parallel Image
 try:
     import cyImage as Image
 except ImportError:
     import Image
+import Qtrac
 from Globals import *
 
 
-Result = collections.namedtuple("Result", "name copied scaled")
+Result = collections.namedtuple("Result", "name copied scaled fingerprint")
+Chunk = collections.namedtuple("Chunk", "results errors seconds")
 
 
-def scale(size, source, target, report_progress, state, when_finished):
+def scale(size, source, target, report_progress, state, when_finished,
+        incremental=False):
+    manifest = (Qtrac.Manifest(os.path.join(target, MANIFEST),
+                dict(size=size, smooth=True)) if incremental else None)
+    counts = collections.Counter()
+    concurrency = multiprocessing.cpu_count()
+    sizer = Qtrac.ChunkSizer()
     futures = set()
     with concurrent.futures.ProcessPoolExecutor(
-            max_workers=multiprocessing.cpu_count()) as executor:
-        for sourceImage, targetImage in get_jobs(source, target):
-            future = executor.submit(scale_one, size, sourceImage,
-                    targetImage, state)
+            max_workers=concurrency) as executor:
+        jobs = get_jobs(source, target, manifest, counts)
+        for chunk in sizer.chunks(jobs):
+            if len(futures) >= 4 * concurrency: # Observe some chunk sizes
+                done, futures = concurrent.futures.wait(futures,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                finish(done, source, sizer, manifest)
+            future = executor.submit(scale_chunk, size, chunk, state,
+                    incremental)
             future.add_done_callback(report_progress)
             futures.add(future)
             if state.value in {CANCELED, TERMINATING}:
@@ -41,31 +55,89 @@ def scale(size, source, target, report_progress, state, when_finished):
                 executor.shutdown()
                 break
         concurrent.futures.wait(futures) # Keep working until finished
+        finish(futures, source, sizer, manifest)
+    if manifest is not None:
+        manifest.save()
     if state.value != TERMINATING:
-        when_finished()
+        when_finished(counts["unchanged"])
 
 
-def get_jobs(source, target):
-    for name in os.listdir(source):
-        yield os.path.join(source, name), os.path.join(target, name)
+def get_jobs(source, target, manifest, counts):
+    with os.scandir(source) as entries:
+        for entry in entries:
+            sourceImage = entry.path
+            targetImage = os.path.join(target, entry.name)
+            if manifest is not None and manifest.up_to_date(sourceImage,
+                    targetImage):
+                counts["unchanged"] += 1
+                continue
+            yield sourceImage, targetImage
 
 
-def scale_one(size, sourceImage, targetImage, state):
+def finish(futures, source, sizer, manifest):
+    for future in futures:
+        if not future.cancelled() and future.exception() is None:
+            chunk = future.result()
+            sizer.observe(len(chunk.results) + len(chunk.errors),
+                    chunk.seconds)
+            if manifest is not None:
+                for result in chunk.results:
+                    if result.fingerprint is not None:
+                        manifest.record(os.path.join(source,
+                                os.path.basename(result.name)),
+                                result.name, result.fingerprint)
+
+
+def scale_chunk(size, jobs, state, incremental=False):
+    results = []
+    errors = []
+    start = time.perf_counter()
+    jobs = iter(jobs)
+    for sourceImage, targetImage in jobs:
+        try:
+            results.append(scale_one(size, sourceImage, targetImage,
+                    state, incremental))
+        except Canceled: # Keep the results so far; the rest are skipped
+            errors += ["canceled"] * (1 + sum(1 for _ in jobs))
+            break
+        except Exception as err: # Counted as skipped
+            errors.append(str(err))
+    return Chunk(results, errors, time.perf_counter() - start)
+
+
+def scale_one(size, sourceImage, targetImage, state, incremental=False):
     if state.value in {CANCELED, TERMINATING}:
         raise Canceled()
-    oldImage = Image.Image.from_file(sourceImage)
+    oldImage, fingerprint = load(sourceImage, incremental)
     if state.value in {CANCELED, TERMINATING}:
         raise Canceled()
     if oldImage.width <= size and oldImage.height <= size:
         oldImage.save(targetImage)
-        return Result(targetImage, 1, 0)
+        return Result(targetImage, 1, 0, fingerprint)
     else:
         scale = min(size / oldImage.width, size / oldImage.height)
         newImage = oldImage.scale(scale)
         if state.value in {CANCELED, TERMINATING}:
             raise Canceled()
         newImage.save(targetImage)
-        return Result(targetImage, 0, 1)
+        return Result(targetImage, 0, 1, fingerprint)
+
+
+def load(sourceImage, incremental):
+    # Returns the image and, if incremental, the Fingerprint of the data
+    # it was decoded from. cyImage can only load files, so then the file
+    # is loaded and the Fingerprint is only kept (and the result recorded
+    # in the manifest) if the file is unchanged since it was fingerprinted
+    if not incremental:
+        return Image.Image.from_file(sourceImage), None
+    data, fingerprint = Qtrac.read_fingerprinted(sourceImage)
+    if hasattr(Image, "from_bytes"):
+        return Image.from_bytes(data, sourceImage), fingerprint
+    image = Image.Image.from_file(sourceImage)
+    stat = os.stat(sourceImage)
+    if [stat.st_mtime_ns, stat.st_size] != fingerprint.validator:
+        fingerprint = None
+    return image, fingerprint
 
 
 if __name__ == "__main__":
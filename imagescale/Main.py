@@ -48,6 +48,9 @@ class Window(ttk.Frame):
         self.statusText.set("Choose or enter folders, then click Scale...")
         self.dimensionText = tk.StringVar()
         self.restore = settings.get_bool(GENERAL, RESTORE, True)
+        self.incremental = tk.BooleanVar()
+        self.incremental.set(settings.get_bool(GENERAL, INCREMENTAL,
+                False))
         self.total = self.copied = self.scaled = 0
         self.worker = None
         self.state = multiprocessing.Manager().Value("i", IDLE)
@@ -97,6 +100,9 @@ class Window(ttk.Frame):
                 values=("50", "100", "150", "200", "250", "300", "350",
                         "400", "450", "500"))
         TkUtil.set_combobox_item(self.dimensionCombobox, "400")
+        self.incrementalCheckbutton = ttk.Checkbutton(self,
+                text="Incremental", underline=-1 if TkUtil.mac() else 1,
+                variable=self.incremental)
 
 
     def layout_widgets(self):
@@ -110,6 +116,8 @@ class Window(ttk.Frame):
         self.targetButton.grid(row=1, column=4, **pad)
         self.dimensionLabel.grid(row=2, column=0, sticky=tk.W, **pad)
         self.dimensionCombobox.grid(row=2, column=1, **padWE)
+        self.incrementalCheckbutton.grid(row=2, column=2, sticky=tk.W,
+                **pad)
         self.helpButton.grid(row=2, column=3, **pad)
         self.scaleButton.grid(row=2, column=4, **pad)
         self.aboutButton.grid(row=3, column=3, **pad)
@@ -127,6 +135,8 @@ class Window(ttk.Frame):
             self.master.bind("<Alt-h>", self.help)
             self.master.bind("<Alt-i>", lambda *args:
                     self.dimensionCombobox.focus())
+            self.master.bind("<Alt-n>", lambda *args:
+                    self.incremental.set(not self.incremental.get()))
             self.master.bind("<Alt-o>", lambda *args:
                     self.sourceEntry.focus())
             self.master.bind("<Alt-q>", self.close)
@@ -143,6 +153,7 @@ class Window(ttk.Frame):
     def close(self, event=None):
         settings = TkUtil.Settings.Data
         settings.put(GENERAL, RESTORE, self.restore)
+        settings.put(GENERAL, INCREMENTAL, self.incremental.get())
         if self.restore:
             geometry = TkUtil.geometry_for_str(self.master.geometry())
             position = TkUtil.str_for_geometry(x=geometry.x, y= geometry.y)
@@ -158,7 +169,9 @@ class Window(ttk.Frame):
     def help(self, event=None):
         paras = [
 """Reads all the images in the source directory and produces smoothly
-scaled copies in the target directory."""]
+scaled copies in the target directory.""",
+"""If Incremental is checked, images that are unchanged since an
+earlier incremental run scaled them are skipped."""]
         messagebox.showinfo("Help — {}".format(APPNAME),
                 "\n\n".join([para.replace("\n", " ") for para in paras]),
                 parent=self)
@@ -187,7 +200,8 @@ scaled copies in the target directory."""]
         self.scaleButton.config(text=text, underline=underline)
         state = tk.DISABLED if guiState != IDLE else "!" + tk.DISABLED
         for widget in (self.sourceEntry, self.sourceButton,
-                self.targetEntry, self.targetButton):
+                self.targetEntry, self.targetButton,
+                self.incrementalCheckbutton):
             widget.state((state,))
         self.master.update() # Make sure the GUI refreshes
 
@@ -228,7 +242,7 @@ scaled copies in the target directory."""]
         self.worker = threading.Thread(target=ImageScale.scale, args=(
                 int(self.dimensionText.get()), self.sourceText.get(),
                 target, self.report_progress, self.state,
-                self.when_finished))
+                self.when_finished, self.incremental.get()))
         self.worker.daemon = True
         self.worker.start() # returns immediately
 
@@ -237,19 +251,20 @@ scaled copies in the target directory."""]
         if self.state.value in {CANCELED, TERMINATING}:
             return
         with ReportLock:    # Serializes calls to Window.report_progress()
-            self.total += 1 # and accesses to self.total, etc.
-            if future.exception() is None:
-                result = future.result()
-                self.copied += result.copied
-                self.scaled += result.scaled
-                name = os.path.basename(result.name)
-                self.statusText.set("{} {}".format(
-                        "Copied" if result.copied else "Scaled", name))
-                self.master.update() # Make sure the GUI refreshes
+            if future.exception() is None: # and accesses to self.total, etc.
+                chunk = future.result()
+                self.total += len(chunk.results) + len(chunk.errors)
+                for result in chunk.results:
+                    self.copied += result.copied
+                    self.scaled += result.scaled
+                    name = os.path.basename(result.name)
+                    self.statusText.set("{} {}".format(
+                            "Copied" if result.copied else "Scaled", name))
+                    self.master.update() # Make sure the GUI refreshes
 
 
     # Must only be called by the single worker thread when it has finished
-    def when_finished(self):
+    def when_finished(self, unchanged=0):
         self.state.value = IDLE
         self.configure(cursor="arrow")
         self.update_ui()
@@ -257,6 +272,8 @@ scaled copies in the target directory."""]
         difference = self.total - (self.copied + self.scaled)
         if difference: # This will kick in if the user canceled
             result += " Skipped {}".format(difference)
+        if unchanged:
+            result += " Unchanged {}".format(unchanged)
         self.statusText.set(result)
         self.master.update() # Make sure the GUI refreshes
 